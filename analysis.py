@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+analysis.py
+
+Group summaries over every session in `data/`.
+
+Session CSVs are parsed in parallel over a process pool. Each file's parsed
+columns are cached in `analysis_cache/` as an .npz, stamped with the file's
+modification time and size, so after a new session only that one file is
+parsed again. From the columns we get hit rates by trial type and run, RT
+distributions by trial type, each staircase's duration (in frames) over its
+trials, and each session's total earnings.
+
+    python analysis.py data --out results
+"""
+import argparse
+import csv
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from datafiles import column, find_sessions, read_session, trial_rows
+
+# bump this if read_session changes, so old caches are ignored
+cache_version = 1
+default_cache_dir = 'analysis_cache'
+
+quantiles = [5, 25, 50, 75, 95]
+
+
+def cache_path(cache_dir, path):
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{name}_{key}.npz")
+
+
+def load_columns(path, cache_dir=default_cache_dir):
+    """
+    Columns of a session CSV, from the cache if the file hasn't changed.
+    Returns (columns, parsed), where `parsed` is True if the CSV was read.
+    """
+    stat = os.stat(path)
+    stamp = np.array([cache_version, stat.st_mtime_ns, stat.st_size])
+    cached = cache_path(cache_dir, path)
+    if os.path.exists(cached):
+        with np.load(cached) as z:
+            if np.array_equal(z['stamp'], stamp):
+                return {str(name): z[f'c{i}'] for i, name in enumerate(z['names'])}, False
+
+    columns = read_session(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    arrays = {f'c{i}': a for i, a in enumerate(columns.values())}
+    # write then rename, so an interrupted run never leaves half a file
+    tmp = cached + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, stamp=stamp, names=np.array(list(columns), dtype=str), **arrays)
+    os.replace(tmp, cached)
+    return columns, True
+
+
+def first_value(column):
+    """First filled-in value of a column, as it was written"""
+    for v in column:
+        if isinstance(v, (float, np.floating)):
+            if not np.isnan(v):
+                return str(int(v)) if float(v).is_integer() else str(v)
+        elif v != '':
+            return str(v)
+    return ''
+
+
+def session_summary(path, cache_dir=default_cache_dir):
+    """The pieces of the group summaries that come from one session"""
+    columns, parsed = load_columns(path, cache_dir)
+    trials = trial_rows(columns)
+    summary = {
+        'path': path,
+        'participant': first_value(columns.get('participant', [])),
+        'session': first_value(columns.get('session', [])),
+        'hits': {},
+        'rts': {},
+        'staircase': {},
+        'total_earnings': np.nan,
+        'parsed': parsed,
+    }
+    if not trials.any():
+        # stopped before the first trial
+        return summary
+
+    types = columns['trial.type'][trials]
+    runs = column(columns, 'run', trials).astype(int)
+    hit = column(columns, 'trial.response', trials) == 1
+    rt = column(columns, 'trial.rt', trials)
+    frames = column(columns, 'trial.staircase.durationFrames', trials)
+    step = column(columns, 'trial.staircase.thisTrialN', trials)
+    earnings = column(columns, 'total_earnings', trials)
+    earnings = earnings[~np.isnan(earnings)]
+
+    hits = {}
+    for t, r in set(zip(types, runs)):
+        mask = (types == t) & (runs == r)
+        hits[(str(t), int(r))] = (int(mask.sum()), int(hit[mask].sum()))
+
+    rts = {}
+    staircase = {}
+    for t in np.unique(types):
+        mask = types == t
+        rts[str(t)] = rt[mask & hit & ~np.isnan(rt)]
+        staircase[str(t)] = frames[mask][np.argsort(step[mask], kind='stable')]
+
+    summary.update(hits=hits, rts=rts, staircase=staircase)
+    if len(earnings):
+        summary['total_earnings'] = float(earnings[-1])
+    return summary
+
+
+def summarize_sessions(paths, cache_dir=default_cache_dir, workers=None):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(session_summary, paths, [cache_dir] * len(paths)))
+
+
+def hit_rates(sessions):
+    """Rows of hit rate by trial type and run, pooled and averaged over sessions"""
+    by_cell = defaultdict(list)
+    for s in sessions:
+        for key, counts in s['hits'].items():
+            by_cell[key].append(counts)
+    rows = []
+    for (t, r), counts in sorted(by_cell.items()):
+        n, hits = np.array(counts).T
+        rates = hits / n
+        rows.append({'trial.type': t, 'run': r, 'sessions': len(counts), 'trials': int(n.sum()),
+                     'hit_rate': hits.sum() / n.sum(),
+                     'session_mean': rates.mean(), 'session_sd': rates.std()})
+    return rows
+
+
+def rt_distributions(sessions):
+    """Rows of hit RT summaries by trial type, pooled over sessions"""
+    by_type = defaultdict(list)
+    for s in sessions:
+        for t, rts in s['rts'].items():
+            by_type[t].append(rts)
+    rows = []
+    for t, parts in sorted(by_type.items()):
+        rts = np.concatenate(parts)
+        row = {'trial.type': t, 'n': len(rts)}
+        if len(rts):
+            row.update({'mean': rts.mean(), 'sd': rts.std()})
+            row.update({f'q{q}': v for q, v in zip(quantiles, np.percentile(rts, quantiles))})
+        rows.append(row)
+    return rows
+
+
+def staircase_trajectories(sessions):
+    """Rows of mean staircase duration (frames) at each trial of each staircase"""
+    by_type = defaultdict(list)
+    for s in sessions:
+        for t, frames in s['staircase'].items():
+            by_type[t].append(frames)
+    rows = []
+    for t, parts in sorted(by_type.items()):
+        # sessions cut short have shorter trajectories
+        length = max(len(p) for p in parts)
+        padded = np.full((len(parts), length), np.nan)
+        for i, p in enumerate(parts):
+            padded[i, :len(p)] = p
+        n = (~np.isnan(padded)).sum(axis=0)
+        mean = np.nanmean(padded, axis=0)
+        sd = np.nanstd(padded, axis=0)
+        for i in range(length):
+            rows.append({'trial.type': t, 'trial': i, 'sessions': int(n[i]),
+                         'mean_frames': mean[i], 'sd_frames': sd[i]})
+    return rows
+
+
+def earnings(sessions):
+    return [{'participant': s['participant'], 'session': s['session'],
+             'total_earnings': s['total_earnings'], 'file': s['path']} for s in sessions]
+
+
+def write_rows(path, rows):
+    fields = []
+    for row in rows:
+        fields += [k for k in row if k not in fields]
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('data_dir', nargs='?', default='data')
+    parser.add_argument('--cache-dir', default=default_cache_dir)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default=None, help='directory to write the summary CSVs to')
+    args = parser.parse_args()
+
+    paths = find_sessions(args.data_dir)
+    if not paths:
+        parser.error(f"no session CSVs in {args.data_dir}")
+    sessions = summarize_sessions(paths, args.cache_dir, args.workers)
+    parsed = sum(s['parsed'] for s in sessions)
+    print(f"{len(sessions)} sessions, {parsed} parsed, {len(sessions) - parsed} from cache")
+
+    tables = {
+        'hit_rates': hit_rates(sessions),
+        'rts': rt_distributions(sessions),
+        'staircase': staircase_trajectories(sessions),
+        'earnings': earnings(sessions),
+    }
+
+    print("\nhit rate by trial type and run")
+    for row in tables['hit_rates']:
+        print(f"  {row['trial.type']:12} run {row['run']}: {row['hit_rate']:.3f} "
+              f"({row['trials']} trials, {row['sessions']} sessions)")
+    print("\nhit RTs by trial type")
+    for row in tables['rts']:
+        if row['n']:
+            print(f"  {row['trial.type']:12} n {row['n']:5}  mean {row['mean']:.3f}  sd {row['sd']:.3f}  "
+                  f"median {row['q50']:.3f}")
+    print("\ntotal earnings")
+    totals = np.array([row['total_earnings'] for row in tables['earnings']])
+    print(f"  mean {np.nanmean(totals):.2f}  sd {np.nanstd(totals):.2f}  "
+          f"min {np.nanmin(totals):.0f}  max {np.nanmax(totals):.0f}")
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        for name, rows in tables.items():
+            write_rows(os.path.join(args.out, name + '.csv'), rows)
+        print(f"\nwrote {', '.join(tables)} to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+bidsevents.py
+
+BIDS `_events.tsv` files for each run, from mid.py's trial data.
+
+Every trial becomes three events: the cue, the target and the feedback,
+each with its onset in seconds from the start of the run (the TTL in the
+scanner) and its duration. EventsWriter appends a trial's events as soon
+as the trial is recorded, so during a session the events files are always
+up to date; `convert` does the same for session files already in `data/`,
+reading each one a row at a time. Existing events files are never
+overwritten: `convert` skips a session whose files are already there, and
+a session run again live gets a numbered `acq` label instead.
+
+    python bidsevents.py data --out data/bids
+"""
+import argparse
+import glob
+import os
+
+from datafiles import find_sessions, iter_rows
+from scoring import cue_time, feedback_time, max_target_dur, single_speed_factor
+
+task = 'mid'
+
+columns = ['onset', 'duration', 'trial_type', 'condition', 'trial_number',
+           'response_time', 'hit', 'reward', 'total_earnings']
+
+
+def number(row, name):
+    """A value from a data row as a float, or None if it's blank or missing"""
+    value = row.get(name)
+    if value is None or value == '':
+        return None
+    value = float(value)
+    return None if value != value else value
+
+
+def label(value):
+    # participant and session go into file names, so 12.0 should be 12
+    value = str(value)
+    return value[:-2] if value.endswith('.0') else value
+
+
+def run_onsets(row):
+    """
+    Cue, target and feedback onsets on the run clock. Older data only has
+    the trial's start time, so those are worked out from the fixations.
+    """
+    cue, target, feedback = (number(row, f'time.{e}.onset') for e in ('cue', 'target', 'feedback'))
+    if cue is not None:
+        return cue, target, feedback
+    run_start = number(row, 'time.global') - number(row, 'time.run')
+    speed = single_speed_factor if number(row, 'run') == 0 else 1.0
+    cue = number(row, 'time.onset') - run_start
+    target = cue + cue_time + number(row, 'fix.after.cue') * speed
+    feedback = target + max_target_dur + number(row, 'fix.after.stim') * speed
+    return cue, target, feedback
+
+
+def trial_events(row):
+    """The three events for one trial row, as dicts of the events.tsv columns"""
+    cue, target, feedback = run_onsets(row)
+    target_duration = number(row, 'trial.target.measured_duration')
+    if target_duration is None:
+        target_duration = number(row, 'trial.staircase_stim_duration')
+    hit = number(row, 'trial.response')
+    shared = {
+        'condition': row['trial.type'],
+        'trial_number': int(number(row, 'trial.number')),
+        'hit': None if hit is None else int(hit),
+    }
+    return [
+        dict(shared, onset=cue, duration=cue_time, trial_type='cue'),
+        dict(shared, onset=target, duration=target_duration, trial_type='target',
+             response_time=number(row, 'trial.rt')),
+        dict(shared, onset=feedback, duration=feedback_time, trial_type='feedback',
+             reward=number(row, 'trial.reward'), total_earnings=number(row, 'total_earnings')),
+    ]
+
+
+def format_value(value):
+    if value is None:
+        return 'n/a'
+    if isinstance(value, float):
+        return f"{value:.4f}".rstrip('0').rstrip('.')
+    return str(value)
+
+
+def events_path(out_dir, participant, session, run, acq=None):
+    sub = f"sub-{label(participant)}"
+    ses = f"ses-{label(session)}"
+    acq = f"_acq-{acq}" if acq else ''
+    name = f"{sub}_{ses}_task-{task}{acq}_run-{int(run) + 1:02d}_events.tsv"
+    return os.path.join(out_dir, sub, ses, 'func', name)
+
+
+def existing_events(out_dir, participant, session, acq=None):
+    """Events files already written for a participant, session and acq label"""
+    pattern = events_path(out_dir, participant, session, 0, acq).replace('_run-01_', '_run-*_')
+    return sorted(glob.glob(pattern))
+
+
+def free_acq(out_dir, participant, session, acq=None):
+    """
+    `acq`, or if that session already has events files with it, the same
+    label numbered from 2 ('resumed2', or 'repeat2' with no label)
+    """
+    label, k = acq, 1
+    while existing_events(out_dir, participant, session, label):
+        k += 1
+        label = f"{acq or 'repeat'}{k}"
+    return label
+
+
+class EventsWriter:
+    """
+    Appends trials to each run's events file as they come in. Rows that
+    aren't trials (run starts) are skipped, so this can be handed every
+    row mid.py records.
+
+    `acq` labels the files, e.g. 'resumed' for a session picked up from a
+    checkpoint, whose runs are new scans with their own TTL.
+    """
+
+    def __init__(self, out_dir, participant, session, acq=None):
+        self.out_dir = out_dir
+        self.participant = participant
+        self.session = session
+        self.acq = acq
+        self.files = {}
+
+    def file_for(self, run):
+        if run not in self.files:
+            path = events_path(self.out_dir, self.participant, self.session, run, self.acq)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 'x' so an earlier session's events are never written over
+            f = open(path, 'x', newline='')
+            f.write('\t'.join(columns) + '\n')
+            self.files[run] = f
+        return self.files[run]
+
+    def write_trial(self, row):
+        if number(row, 'trial.number') is None:
+            return
+        f = self.file_for(int(number(row, 'run')))
+        for event in trial_events(row):
+            f.write('\t'.join(format_value(event.get(c)) for c in columns) + '\n')
+        # so whatever's there can be picked up while the session goes on
+        f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+def convert(path, out_dir):
+    """
+    Write events files for every run in a session file; returns the number
+    of trials. Raises FileExistsError if the session's events files are
+    already there.
+    """
+    n = 0
+    writer = None
+    for row in iter_rows(path):
+        if writer is None:
+            # labelled as mid.py labels them live
+            resumed = str(row.get('resume from checkpoint? (yes or no)', 'no')).lower() == 'yes'
+            writer = EventsWriter(out_dir, row['participant'], row['session'],
+                                  acq='resumed' if resumed else None)
+            existing = existing_events(out_dir, writer.participant, writer.session, writer.acq)
+            if existing:
+                raise FileExistsError(f"{existing[0]} is already there")
+        if number(row, 'trial.number') is not None:
+            writer.write_trial(row)
+            n += 1
+    if writer is not None:
+        writer.close()
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('data_dir', nargs='?', default='data')
+    parser.add_argument('--out', default=os.path.join('data', 'bids'))
+    args = parser.parse_args()
+
+    for path in find_sessions(args.data_dir):
+        try:
+            n = convert(path, args.out)
+        except FileExistsError as e:
+            print(f"{path}: skipped, {e}")
+            continue
+        print(f"{path}: {n} trials")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+checkpoint.py
+
+Per-trial checkpoints, so a session can be picked up from the next trial
+after a crash or an escape.
+
+After every trial mid.py appends one JSON line with everything needed to
+carry on: where it is (run and next trial), the trial count, total
+earnings, the order files, every staircase's full state and the random
+number generator's state. The file is only ever appended to, and a line
+cut short by a crash is skipped, so the last complete line is always the
+state after the last finished trial.
+"""
+import json
+import os
+import random
+
+
+def checkpoint_path(data_dir, exp_name, fmri, participant, session):
+    """Checkpoint file for a participant and session, the same for every restart"""
+    kind = ['behavioral', 'fmri'][fmri]
+    return os.path.join(data_dir, f"{exp_name}_{kind}_{participant:04d}_session{session}_checkpoint.jsonl")
+
+
+def ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+class Checkpoint:
+    """Appends states to a checkpoint file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+        if self.file.tell() and not ends_with_newline(path):
+            # finish off a line cut short by a crash, so it's skipped on its own
+            self.file.write('\n')
+
+    def write(self, state):
+        self.file.write(json.dumps(state) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def load_latest(path):
+    """The last complete state in a checkpoint file, or None"""
+    if not os.path.exists(path):
+        return None
+    latest = None
+    with open(path) as f:
+        for line in f:
+            try:
+                latest = json.loads(line)
+            except ValueError:
+                # cut short by a crash
+                continue
+    return latest
+
+
+def restore_random(state):
+    """Put a random.getstate() that's been through JSON back"""
+    version, internal, gauss_next = state
+    random.setstate((version, tuple(internal), gauss_next))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+datafiles.py
+
+Reading the session files mid.py writes into `data/`.
+
+Each session's ExperimentHandler CSV is one wide table with a row per run
+start and a row per trial. Sessions run with `stream_output` are JSON lines
+instead: the setup dialog values on the first line, then one row per line.
+`iter_rows` goes through either a row at a time, as dicts with the setup
+values filled into every row like the CSV has them. `read_session` reads a
+whole session into columns: a dict of NumPy arrays keyed by column name,
+numeric where every filled-in value is a number (blanks become NaN) and
+strings otherwise (blanks become '').
+"""
+import csv
+import glob
+import json
+import os
+
+import numpy as np
+
+
+def is_session_file(path):
+    name, ext = os.path.splitext(os.path.basename(path))
+    return (ext in ('.csv', '.jsonl') and name.split('_')[1:2] in (['behavioral'], ['fmri'])
+            and not name.endswith('_checkpoint'))
+
+
+def find_sessions(data_dir='data'):
+    """Session CSVs and JSON lines files under `data_dir`, sorted by name"""
+    paths = glob.glob(os.path.join(data_dir, '**', '*.*'), recursive=True)
+    return sorted(p for p in paths if is_session_file(p))
+
+
+def iter_rows(path):
+    """Rows of a session file, one at a time"""
+    if path.endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            extra = json.loads(next(f))['extraInfo']
+            for line in f:
+                row = json.loads(line)
+                yield {**row, **{k: v for k, v in extra.items() if k not in row}}
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            yield from csv.DictReader(f)
+
+
+def to_column(values):
+    values = ['' if v is None else v for v in values]
+    try:
+        return np.array([float(v) if v != '' else np.nan for v in values])
+    except ValueError:
+        return np.array(values, dtype=str)
+
+
+def read_session(path):
+    """Columns of a session file, as a dict of arrays"""
+    if path.endswith('.jsonl'):
+        rows = list(iter_rows(path))
+        names = list(dict.fromkeys(name for row in rows for name in row))
+        return {name: to_column([row.get(name) for row in rows]) for name in names}
+
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+    columns = {}
+    for i, name in enumerate(header):
+        # ExperimentHandler ends every line with a comma
+        if not name or name in columns:
+            continue
+        columns[name] = to_column([row[i] if i < len(row) else '' for row in rows])
+    return columns
+
+
+def trial_rows(columns):
+    """Mask of the rows that are trials, rather than run starts"""
+    numbers = columns.get('trial.number')
+    if numbers is None or numbers.dtype.kind != 'f':
+        # no trials at all, e.g. a session stopped during the instructions
+        n = len(next(iter(columns.values()))) if columns else 0
+        return np.zeros(n, dtype=bool)
+    return ~np.isnan(numbers)
+
+
+def column(columns, name, mask):
+    """
+    A numeric column on the rows in `mask`, all NaN if the file doesn't have
+    it; mid.py only writes some columns when they happen, e.g. `trial.rt`
+    on a hit
+    """
+    values = columns.get(name)
+    if values is None or values.dtype.kind != 'f':
+        return np.full(int(mask.sum()), np.nan)
+    return values[mask]
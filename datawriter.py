@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+datawriter.py
+
+Keeps data recording off the trial loop in mid.py.
+
+BackgroundRecorder has the same addData/nextEntry interface as
+data.ExperimentHandler. The current row is built up in a plain dict, and
+finished rows go into a bounded queue that a writer thread drains into the
+real ExperimentHandler. Log flushes stay on the main thread, since PsychoPy's
+logger doesn't expect to be flushed while another thread is logging; the
+task asks for one at a quiet moment (a long fixation, between runs) and
+never in the middle of a routine.
+
+Anything else that wants each finished row, like the BIDS events writer,
+can be added with add_listener and is called from the same thread. If
+anything on the writer thread fails, it carries on with the rows after it,
+and the error is raised on the main thread the next time a row is handed
+over or the recorder is closed, so the task stops rather than losing data
+quietly.
+
+RowStreamWriter can stand in for the ExperimentHandler: instead of keeping
+every row until the end of the session, it appends each one to a JSON lines
+file as it's finished, so memory stays flat however long the session is and
+there's nothing left to save at the end. Like the ExperimentHandler, it
+never writes over an earlier file: a resumed or rerun session's stream gets
+`_1`, `_2`... added to its name.
+"""
+import json
+import queue
+import threading
+import traceback
+
+from psychopy import logging
+from psychopy.tools.filetools import handleFileCollision
+
+_ROW = 'row'
+_PARTIAL = 'partial'
+_CALL = 'call'
+_STOP = 'stop'
+
+
+class BackgroundRecorder:
+    """
+    Wraps an ExperimentHandler so only the writer thread ever touches it.
+    Call close() before the handler is saved, to make sure every row has
+    been handed over.
+    """
+
+    def __init__(self, exp, maxsize=256):
+        self.exp = exp
+        self.row = {}
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.listeners = []
+        self.error = None   # first exception on the writer thread, raised by _check
+        self.errors = []
+        self.thread = threading.Thread(target=self._drain, name='datawriter', daemon=True)
+        self.thread.start()
+
+    def addData(self, name, value):
+        self.row[name] = value
+
+    def add_listener(self, listener):
+        """Call `listener(row)` with each finished row, on the writer thread"""
+        self.listeners.append(listener)
+
+    def nextEntry(self):
+        self._put((_ROW, self.row))
+        self.row = {}
+
+    def flush(self):
+        """Flush the log files; call this at a quiet moment"""
+        self._check()
+        logging.flush()
+
+    def call(self, function, *args):
+        """Run `function(*args)` on the writer thread, after the rows before it"""
+        self._put((_CALL, (function, args)))
+
+    def close(self):
+        """Hand over everything still pending and wait for the thread to finish"""
+        if self.thread.is_alive():
+            if self.row:
+                # an unfinished trial, e.g. on escape; add it without ending the
+                # entry, same as if we'd been calling the handler directly
+                self._put((_PARTIAL, self.row))
+                self.row = {}
+            self._put((_STOP, None))
+            self.thread.join()
+        logging.flush()
+        self._check()
+
+    def _put(self, item):
+        self._check()
+        while True:
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if not self.thread.is_alive():
+                    raise RuntimeError("data writer thread has stopped")
+
+    def _check(self):
+        """Raise the first error from the writer thread, here on the main thread"""
+        if self.error is not None:
+            error, self.error = self.error, None
+            n = len(self.errors)
+            for message in self.errors[:n]:
+                logging.error(message)
+            del self.errors[:n]
+            raise error
+
+    def _drain(self):
+        while True:
+            kind, item = self.queue.get()
+            if kind == _STOP:
+                break
+            try:
+                if kind in (_ROW, _PARTIAL):
+                    for name, value in item.items():
+                        self.exp.addData(name, value)
+                    if kind == _ROW:
+                        self.exp.nextEntry()
+                        for listener in self.listeners:
+                            listener(item)
+                elif kind == _CALL:
+                    function, args = item
+                    function(*args)
+            except Exception as e:
+                # keep going so the main thread never blocks on a full queue;
+                # logged from the main thread, which owns the logger
+                traceback.print_exc()
+                self.errors.append(f"Data writer: {traceback.format_exc()}")
+                if self.error is None:
+                    self.error = e
+
+
+class RowStreamWriter:
+    """
+    Writes rows to a JSON lines file as they finish. The first line holds
+    `extraInfo` (the setup dialog values), which the CSV would repeat on
+    every row; each line after that is one row.
+    """
+
+    def __init__(self, path, extraInfo=None):
+        self.path = handleFileCollision(path, 'rename')
+        self.row = {}
+        self.file = open(self.path, 'x')
+        self._write({'extraInfo': extraInfo or {}})
+
+    def _write(self, obj):
+        # anything JSON doesn't know, like numpy numbers, goes in as its str()
+        self.file.write(json.dumps(obj, default=plain) + '\n')
+        self.file.flush()
+
+    def addData(self, name, value):
+        self.row[name] = value
+
+    def nextEntry(self):
+        self._write(self.row)
+        self.row = {}
+
+    def close(self):
+        if self.row:
+            self.nextEntry()
+        self.file.close()
+
+
+def plain(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+earnings.py
+
+Lookahead reward controller for nudging total earnings toward a goal.
+
+On a nudged run, each reward or loss is picked from its range to minimize
+the expected distance of the final total from the goal, taking into
+account every trial still to come in the run's order and how likely each
+is to pay out (hits for reward trials, misses for loss trials) given the
+staircases' hit rates so far.
+
+The expected distances are worked out backwards from the end of the run by
+dynamic programming over (trial, earnings so far), once at the start of
+the run. What's left is a table of the best amount for every trial and
+total, so picking a reward during the run is a list lookup.
+"""
+import numpy as np
+
+# hit rate the staircases home in on (1 up, 2 down), used until a
+# staircase has data of its own
+target_hit_rate = 2 / 3
+prior_trials = 4
+
+
+def hit_rate(stair, prior=target_hit_rate, prior_n=prior_trials):
+    """A staircase's hit rate so far, shrunk toward `prior` when it has few trials"""
+    return (sum(stair.data) + prior * prior_n) / (len(stair.data) + prior_n)
+
+
+def pays_on_hit(trial_type):
+    # rewards are paid for hits, losses are taken for misses
+    return not trial_type.startswith('loss')
+
+
+class EarningsController:
+    """
+    Best reward for each trial of a run, given the trial types in order,
+    the reward range for each paying type, each type's hit rate, the goal
+    and the total at the start of the run.
+    """
+
+    def __init__(self, trial_types, ranges, hit_rates, goal, total):
+        self.start_total = total
+        down = sum(-min(ranges[t][0], 0) for t in trial_types if t in ranges)
+        up = sum(max(ranges[t][1], 0) for t in trial_types if t in ranges)
+        # every total the run can reach
+        self.lowest = total - down
+        earnings = np.arange(total - down, total + up + 1)
+        rows = np.arange(len(earnings))
+
+        # expected final distance from the goal, from each total, after the
+        # trials so far; at the end it's just the distance
+        value = np.abs(earnings - goal).astype(float)
+        best = np.zeros((len(trial_types), len(earnings)), dtype=np.int64)
+        for k in reversed(range(len(trial_types))):
+            t = trial_types[k]
+            if t not in ranges:
+                continue
+            amounts = np.arange(ranges[t][0], ranges[t][1] + 1)
+            # totals that can't be reached from the start get clipped; they're never looked up
+            after = value[np.clip(rows[:, None] + amounts, 0, len(rows) - 1)]
+            choice = after.argmin(axis=1)
+            best[k] = amounts[choice]
+            p = hit_rates[t] if pays_on_hit(t) else 1 - hit_rates[t]
+            value = p * after[rows, choice] + (1 - p) * value
+
+        self.expected_distance = float(value[total - self.lowest])
+        # nested lists are quicker to index one item at a time than arrays
+        self.best = best.tolist()
+
+    def reward(self, k, total):
+        """Amount to pay on trial `k` of the run, with `total` earned so far"""
+        return self.best[k][int(total) - self.lowest]
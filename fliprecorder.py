@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+fliprecorder.py
+
+Records when every win.flip() returns, tagged with the run, trial and
+routine it belongs to, so we can show which routines drop frames and that
+target exposures went out as intended.
+
+Timestamps go into preallocated NumPy arrays. Recording starts over at
+the start of each run, after the wait for the TTL, so the wait isn't taken
+for a dropped frame and the instructions and breaks aren't counted. At the
+end of each run's trials the flips are saved as a small .npy structured
+array, and a summary of frame intervals and dropped frames per routine is
+saved as JSON and logged.
+"""
+import json
+
+import numpy as np
+from psychopy import core, logging
+from psychopy.tools.filetools import handleFileCollision
+
+routines = ['other', 'cue', 'fixation', 'target', 'feedback']
+
+flip_dtype = np.dtype([
+    ('time', np.float64),
+    ('run', np.int16),
+    ('trial', np.int16),
+    ('routine', np.int8),
+])
+
+# an interval this many frames long or more means at least one was dropped
+dropped_threshold = 1.5
+
+
+class FlipRecorder:
+    """
+    Wraps win.flip once installed. Tags come from whatever set_context was
+    last called with. When `enabled` is False nothing is installed or
+    written, and set_context is just an attribute update.
+    """
+
+    def __init__(self, win, frame_duration, enabled=True, capacity=2 ** 17):
+        self.win = win
+        self.frame_duration = frame_duration
+        self.enabled = enabled
+        self.flips = np.zeros(capacity, dtype=flip_dtype)
+        self.n = 0
+        self.run = -1
+        self.trial = -1
+        self.routine = 0
+        if enabled:
+            self._flip = win.flip
+            win.flip = self.flip
+
+    def set_context(self, run=None, trial=None, routine=None):
+        if run is not None:
+            self.run = run
+        if trial is not None:
+            self.trial = trial
+        if routine is not None:
+            self.routine = routines.index(routine)
+
+    def start_run(self, run):
+        """Drop the flips so far; the next one is the first of `run`"""
+        self.n = 0
+        self.set_context(run=run, trial=0)
+
+    def flip(self, *args, **kwargs):
+        result = self._flip(*args, **kwargs)
+        t = core.getTime()
+        if self.n == len(self.flips):
+            # ran past what we planned for, so make room
+            self.flips = np.concatenate([self.flips, np.zeros_like(self.flips)])
+        self.flips[self.n] = (t, self.run, self.trial, self.routine)
+        self.n += 1
+        return result
+
+    def summary(self, flips):
+        """Frame interval percentiles and dropped frames for each routine"""
+        intervals = np.diff(flips['time'])
+        # an interval belongs to the routine of the flip that ends it
+        tags = flips['routine'][1:]
+        frames = intervals / self.frame_duration
+        result = {'frame_duration': self.frame_duration, 'flips': len(flips), 'routines': {}}
+        for code, name in enumerate(routines):
+            these = intervals[tags == code]
+            if not len(these):
+                continue
+            dropped = np.round(frames[tags == code]) - 1
+            dropped = dropped[frames[tags == code] >= dropped_threshold]
+            p = np.percentile(these, [1, 50, 99]) * 1000
+            result['routines'][name] = {
+                'flips': int(len(these)),
+                'interval_ms_p1': float(p[0]),
+                'interval_ms_p50': float(p[1]),
+                'interval_ms_p99': float(p[2]),
+                'interval_ms_max': float(these.max() * 1000),
+                'late_flips': int(len(dropped)),
+                'dropped_frames': int(dropped.sum()),
+            }
+        return result
+
+    def write_run(self, filename, run):
+        """Save the flips since start_run and their summary next to `filename`"""
+        if not self.enabled:
+            return
+        flips = self.flips[:self.n]
+        # a resumed or rerun session gets _1, _2... rather than overwriting,
+        # as the ExperimentHandler does with its data files
+        base = handleFileCollision(f"{filename}_run{run}_flips", 'rename')
+        np.save(base + '.npy', flips)
+        summary = self.summary(flips)
+        with open(base + '.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+        for name, s in summary['routines'].items():
+            logging.exp(f"Run {run} {name} flips: median {s['interval_ms_p50']:.2f} ms, "
+                        f"99th {s['interval_ms_p99']:.2f} ms, {s['dropped_frames']} dropped")
+        self.n = 0
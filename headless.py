@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+headless.py
+
+Runs mid.py with no window, no keyboard and no real-time waits, so a whole
+session finishes in about a second and can be checked in CI.
+
+Before mid.py is run, PsychoPy's clocks are swapped for a virtual clock
+that only moves when the window flips, the window and stimuli for stand-ins
+that draw nothing, the setup dialog for the values given on the command
+line, and the keyboard for a scripted responder. The responder presses the
+forward/start/TTL key whenever the task waits for one, and injects a
+response to each target into a keyinput.ScriptedKeyboard after an RT drawn
+from a normal distribution, so the staircases, scoring and data files
+behave as they would with a participant.
+
+Everything mid.py writes (data files, checkpoints, BIDS events, the
+session database) goes to its own directory, `headless_data/` unless
+--data-dir says otherwise, so test sessions never mix with study data.
+
+    python headless.py --participant 9001 --session 1
+    python headless.py --participant 9001 --set "use ranged rewards?=yes" --rt-mean 0.3
+"""
+import argparse
+import os
+import random
+import runpy
+import sys
+import types
+
+from psychopy import core, constants
+
+frame_rate = 60.0
+default_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'headless_data')
+
+
+class VirtualTime:
+    """The one clock everything reads; moves forward a frame per flip"""
+    now = 0.0
+
+
+class Clock:
+    def __init__(self):
+        self._timeAtLastReset = VirtualTime.now
+
+    def getTime(self, applyZero=True):
+        return VirtualTime.now - self._timeAtLastReset
+
+    def reset(self, newT=0.0):
+        self._timeAtLastReset = VirtualTime.now + newT
+
+    def add(self, t):
+        self._timeAtLastReset += t
+
+    def getLastResetTime(self):
+        return self._timeAtLastReset
+
+
+class CountdownTimer(Clock):
+    def __init__(self, start=0):
+        self._timeAtLastReset = VirtualTime.now + start
+
+    def getTime(self):
+        return self._timeAtLastReset - VirtualTime.now
+
+    def reset(self, t=0):
+        self._timeAtLastReset = VirtualTime.now + t
+
+
+def get_time():
+    return VirtualTime.now
+
+
+def wait(secs, hogCPUperiod=0.2):
+    VirtualTime.now += secs
+
+
+def quit():
+    sys.exit(0)
+
+
+class Responder:
+    """
+    Scripted participant. Presses the first allowed key whenever the task
+    waits for one, and injects a timestamped response to each target onset
+    into a ScriptedKeyboard, which stands in for psychopy's Keyboard.
+    """
+
+    def __init__(self, rt_mean=0.25, rt_sd=0.04, response_key='1', seed=None):
+        self.rt_mean = rt_mean
+        self.rt_sd = rt_sd
+        self.response_key = response_key
+        self.rng = random.Random(seed)
+        self.keyboard = None
+
+    def make_keyboard(self, *args, **kwargs):
+        # imported here so it picks up the virtual clock
+        from keyinput import ScriptedKeyboard
+        if self.keyboard is None:
+            self.keyboard = ScriptedKeyboard()
+        return self.keyboard
+
+    def target_onset(self, t):
+        rt = self.rng.gauss(self.rt_mean, self.rt_sd)
+        self.keyboard.inject(self.response_key, t + rt)
+
+    def get_keys(self, keyList=None):
+        return [k.name for k in self.keyboard.getKeys(keyList=keyList)]
+
+    def clear(self):
+        self.keyboard.clearEvents()
+
+    def wait_keys(self, keyList=None):
+        # answer straight away, a frame later
+        VirtualTime.now += 1.0 / frame_rate
+        if keyList is None:
+            return [self.response_key]
+        if isinstance(keyList, str):
+            return [keyList]
+        return [keyList[0]]
+
+
+class VirtualWindow:
+    def __init__(self, *args, **kwargs):
+        self.size = kwargs.get('size', [800, 600])
+        self.units = kwargs.get('units', 'height')
+        self.monitor = kwargs.get('monitor')
+        self.monitorFramePeriod = 1.0 / frame_rate
+        self.autoDraw = []
+        self.drawn = set()
+        self.on_flip = []
+        self.target_up = False
+        self.frameIntervals = []
+        self._recordFrameIntervals = False
+        self.last_flip = None
+
+    @property
+    def recordFrameIntervals(self):
+        return self._recordFrameIntervals
+
+    @recordFrameIntervals.setter
+    def recordFrameIntervals(self, value):
+        # like psychopy, the first interval after turning it on is skipped
+        self._recordFrameIntervals = value
+        self.last_flip = None
+
+    def getActualFrameRate(self, *args, **kwargs):
+        return frame_rate
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self.on_flip.append((function, args, kwargs))
+
+    def flip(self, clearBuffer=True):
+        for stim in self.autoDraw:
+            stim.draw()
+        VirtualTime.now += self.monitorFramePeriod
+        if self._recordFrameIntervals:
+            if self.last_flip is not None:
+                self.frameIntervals.append(VirtualTime.now - self.last_flip)
+            self.last_flip = VirtualTime.now
+        for function, args, kwargs in self.on_flip:
+            function(*args, **kwargs)
+        self.on_flip = []
+
+        target_up = any(isinstance(s, Rect) for s in self.drawn)
+        if target_up and not self.target_up:
+            responder.target_onset(VirtualTime.now)
+        self.target_up = target_up
+        self.drawn = set()
+        return VirtualTime.now
+
+    def clearBuffer(self, color=True, depth=False, stencil=False):
+        self.drawn = set()
+
+    def close(self):
+        pass
+
+
+class VirtualStim:
+    """Stands in for any stimulus: remembers its settings and draws nothing"""
+
+    def __init__(self, win=None, *args, **kwargs):
+        self.win = win
+        self.status = constants.NOT_STARTED
+        self.autoDraw = False
+        self.__dict__.update(kwargs)
+
+    def draw(self, win=None):
+        self.win.drawn.add(self)
+
+    def setText(self, text, log=None):
+        self.text = text
+
+    def setImage(self, image, log=None):
+        self.image = image
+
+    def setAutoDraw(self, value, log=None):
+        self.autoDraw = value
+        if value:
+            self.status = constants.STARTED
+            if self not in self.win.autoDraw:
+                self.win.autoDraw.append(self)
+        else:
+            self.status = constants.STOPPED
+            if self in self.win.autoDraw:
+                self.win.autoDraw.remove(self)
+
+
+class TextStim(VirtualStim):
+    pass
+
+
+class ImageStim(VirtualStim):
+    pass
+
+
+class Rect(VirtualStim):
+    pass
+
+
+class Monitor:
+    def __init__(self, name, *args, **kwargs):
+        self.name = name
+
+    def setSizePix(self, size):
+        self.size = size
+
+
+class DlgFromDict:
+    """
+    Fills in the setup dialogs from the command line instead of asking.
+    Each dialog takes the values for the fields it has.
+    """
+    values = {}
+    used = set()
+
+    def __init__(self, dictionary, title='', **kwargs):
+        for key, value in self.values.items():
+            if key in dictionary:
+                dictionary[key] = value
+                self.used.add(key)
+        self.OK = True
+
+
+class Mouse:
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class BuilderKeyResponse:
+    def __init__(self):
+        self.status = constants.NOT_STARTED
+        self.keys = []
+        self.corr = 0
+        self.rt = []
+        self.clock = Clock()
+
+
+def clear_events(eventType=None):
+    responder.clear()
+
+
+responder = Responder()
+
+
+def install(responder_=None):
+    """Swap the PsychoPy pieces mid.py uses for virtual ones"""
+    global responder
+    if responder_ is not None:
+        responder = responder_
+    if 'MID_DATA_DIR' not in os.environ:
+        use_data_dir()
+
+    core.Clock = Clock
+    core.CountdownTimer = CountdownTimer
+    core.getTime = get_time
+    core.wait = wait
+    core.quit = quit
+
+    visual = types.ModuleType('psychopy.visual')
+    visual.Window = VirtualWindow
+    visual.TextStim = TextStim
+    visual.ImageStim = ImageStim
+    visual.Rect = Rect
+
+    event = types.ModuleType('psychopy.event')
+    event.getKeys = lambda keyList=None, timeStamped=False: responder.get_keys(keyList)
+    event.waitKeys = lambda maxWait=None, keyList=None, **kwargs: responder.wait_keys(keyList)
+    event.clearEvents = clear_events
+    event.Mouse = Mouse
+    event.BuilderKeyResponse = BuilderKeyResponse
+
+    gui = types.ModuleType('psychopy.gui')
+    gui.DlgFromDict = DlgFromDict
+
+    monitors = types.ModuleType('psychopy.monitors')
+    monitors.Monitor = Monitor
+
+    # the virtual window's rate says nothing about a real display, so
+    # measure it every time and keep it out of the frame rate cache
+    import startup
+    startup.frame_rate = lambda win, *args, **kwargs: (win.getActualFrameRate(), False)
+
+    import psychopy
+    for name, module in (('visual', visual), ('event', event), ('gui', gui), ('monitors', monitors)):
+        sys.modules['psychopy.' + name] = module
+        setattr(psychopy, name, module)
+
+    keyboard = types.ModuleType('psychopy.hardware.keyboard')
+    keyboard.Keyboard = responder.make_keyboard
+    hardware = types.ModuleType('psychopy.hardware')
+    hardware.keyboard = keyboard
+    sys.modules['psychopy.hardware'] = hardware
+    sys.modules['psychopy.hardware.keyboard'] = keyboard
+    psychopy.hardware = hardware
+    responder.make_keyboard()
+
+
+def use_data_dir(data_dir=default_data_dir):
+    """Have mid.py write to `data_dir` rather than data/"""
+    os.makedirs(data_dir, exist_ok=True)
+    os.environ['MID_DATA_DIR'] = os.path.abspath(data_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--participant', default='9999')
+    parser.add_argument('--session', default='1')
+    parser.add_argument('--set', action='append', default=[], metavar='FIELD=VALUE',
+                        help='any other setup dialog field, e.g. "use ranged rewards?=yes"')
+    parser.add_argument('--rt-mean', type=float, default=0.25, help='responder RT mean in seconds')
+    parser.add_argument('--rt-sd', type=float, default=0.04, help='responder RT sd in seconds')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the responder')
+    parser.add_argument('--data-dir', default=default_data_dir,
+                        help="where mid.py writes everything, instead of data/")
+    args = parser.parse_args()
+
+    values = {'participant': args.participant, 'session': args.session}
+    for item in args.set:
+        key, value = item.split('=', 1)
+        values[key] = value
+    DlgFromDict.values = values
+
+    use_data_dir(args.data_dir)
+    install(Responder(args.rt_mean, args.rt_sd, seed=args.seed))
+    mid = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mid.py')
+    try:
+        runpy.run_path(mid, run_name='__main__')
+    finally:
+        for key in sorted(set(values) - DlgFromDict.used):
+            print(f"warning: {key!r} is not a field in any setup dialog", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+keyinput.py
+
+Timestamped key presses for mid.py.
+
+Polling event.getKeys() once a frame only tells us a key was pressed some
+time in the last frame. KeyInput reads psychopy.hardware.keyboard instead,
+which (with the psychtoolbox backend) records key-downs on a background
+thread with their own timestamps, so RTs are measured when the key went
+down regardless of frame rate.
+
+ScriptedKeyboard has the same interface as psychopy's Keyboard, for tests
+and headless runs: key presses are injected with the time they happen and
+come out of getKeys once that time has passed.
+"""
+import bisect
+
+from psychopy import core, event
+from psychopy.hardware import keyboard
+
+
+class KeyInput:
+    """
+    Key-downs as (name, rt) pairs, where rt is seconds since the last
+    reset_clock(). Reset the clock at the start of a routine, or with
+    win.callOnFlip to measure from a stimulus onset.
+    """
+
+    def __init__(self, kb=None):
+        self.kb = kb if kb is not None else keyboard.Keyboard()
+
+    def reset_clock(self):
+        self.kb.clock.reset()
+
+    def clear(self):
+        self.kb.clearEvents()
+        # waitKeys still reads the event module, so keep its buffer empty too
+        event.clearEvents(eventType='keyboard')
+
+    def get_presses(self, keyList=None):
+        presses = self.kb.getKeys(keyList=keyList, waitRelease=False, clear=True)
+        return [(k.name, k.rt) for k in presses]
+
+
+class KeyPress:
+    def __init__(self, name, tDown, rt):
+        self.name = name
+        self.tDown = tDown
+        self.rt = rt
+        self.duration = None
+
+
+class ScriptedKeyboard:
+    """
+    Test double for psychopy.hardware.keyboard.Keyboard. `inject` a key with
+    the core.getTime() time it goes down; getKeys returns it once that time
+    has come.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.clock = core.Clock()
+        self.events = []  # (tDown, name), kept sorted
+
+    def inject(self, name, tDown):
+        bisect.insort(self.events, (tDown, name))
+
+    def _due(self):
+        return bisect.bisect_right(self.events, (core.getTime(), chr(0x10ffff)))
+
+    def getKeys(self, keyList=None, waitRelease=False, clear=True):
+        due = self.events[:self._due()]
+        keys = [(t, name) for t, name in due if keyList is None or name in keyList]
+        if clear:
+            for k in keys:
+                self.events.remove(k)
+        zero = self.clock.getLastResetTime()
+        return [KeyPress(name, t, t - zero) for t, name in keys]
+
+    def clearEvents(self, eventType=None):
+        del self.events[:self._due()]
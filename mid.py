@@ -13,43 +13,85 @@ To change run length would require regenerating new order files.
 
 Based on code originally written by @nivreggev, see README
 """
+import time
+
 from psychopy import gui, visual, core, data, event, logging, monitors
-from psychopy.constants import (NOT_STARTED, STARTED, PLAYING, PAUSED,
-                                STOPPED, FINISHED, PRESSED, RELEASED, FOREVER)
-from numpy.random import random, shuffle
 import random
 import os
-import csv
-import time
-from pathlib import Path
+
+from bidsevents import EventsWriter, free_acq
+from checkpoint import Checkpoint, checkpoint_path, load_latest, restore_random
+from datawriter import BackgroundRecorder, RowStreamWriter
+from fliprecorder import FlipRecorder, routines
+from keyinput import KeyInput
+from orderbank import OrderBank, load_order, read_order_csv
+from quest import QuestStaircase
+import scoring
+from sessiondb import latest_staircase_end, record_session
+from stairstate import get_state, set_state
+from startup import ImageLoader, frame_rate, warm_up
+from stimcache import FeedbackTextCache
+from timeline import RoutineEngine, compile_run, frames_for, trial_slots
 
 ## setting up some user-defined variables
 
 DEBUG = False
 expName = "MID"
 version = "1.0"
-data_dir = "data" # location of outputs to be generated; includes data for participants as well as trial selection and trial presentation sequence
+data_dir = os.environ.get("MID_DATA_DIR", "data") # location of outputs to be generated; includes data for participants as well as trial selection and trial presentation sequence (headless.py points this elsewhere)
 inst_dir = "text" # location of instructions directory
+bids_dir = os.path.join(data_dir, "bids") # fMRI sessions write BIDS events.tsv files here as each trial finishes (see bidsevents.py); None to turn off
+session_db = os.path.join(data_dir, "sessions.db") # staircase end values and earnings of finished sessions (see sessiondb.py)
+stream_output = False # write each row to a .jsonl file as it finishes, instead of keeping everything for a .csv and .psydat at the end
+order_bank = None # compiled order bank (see orderbank.py), e.g. "orders/bank.npy"; if None, pick from the CSVs in orders/
 
-# Four runs, first is the practice/calibration one
-num_runs = 4
-# Trials per run
-num_trials = 30
+# Run length, timings and the earnings goal are shared with the scripts that
+# read or simulate sessions, so they're set in scoring.py
+num_runs = scoring.num_runs # four runs, first is the practice/calibration one
+num_trials = scoring.num_trials # trials per run
 
 
 pre_instructions_duration = 60 # added time before instructions to acclimate to scanner
-initial_fix_duration = 8 # added time to make sure homogenicity of magnetic field is reached
-min_target_dur = 0.1 # sets the minimum presentation time for target (in seconds)
-max_target_dur = 0.5 # maximum presentation of target (in seconds)
-cue_time = 2.0 # how long the cue is displayed (in seconds)
-feedback_time = 2.0 # how long the trial + total reward feedback is displayed (in seconds)
+initial_fix_duration = scoring.initial_fix_duration # added time to make sure homogenicity of magnetic field is reached
+min_target_dur = scoring.min_target_dur # sets the minimum presentation time for target (in seconds)
+max_target_dur = scoring.max_target_dur # maximum presentation of target (in seconds)
+cue_time = scoring.cue_time # how long the cue is displayed (in seconds)
+feedback_time = scoring.feedback_time # how long the trial + total reward feedback is displayed (in seconds)
 closing_duration = 8.0 # added time at end of last run to make sure we capture enough
 
-single_speed_factor = 0.25 # how much to multiply fixations by, if doing a practice/staircase-stabilizing run, to speed it up
+# Frame rates are measured once per monitor profile and resolution, then
+# read from this file; set remeasure_frame_rate to measure again
+frame_rate_cache = os.path.join(data_dir, "framerate.json")
+remeasure_frame_rate = False
+
+single_speed_factor = scoring.single_speed_factor # how much to multiply fixations by, if doing a practice/staircase-stabilizing run, to speed it up
+
+# Record the time of every screen flip, tagged by run, trial and routine, and
+# save them with a summary of dropped frames at the end of each run
+record_flips = False
+
+# How each trial type's target duration adapts: 'staircase' (PsychoPy's
+# StairHandler, below) or 'quest' (a Bayesian procedure that starts near
+# threshold sooner, see quest.py). Either starts from the dialog's staircase
+# start value.
+adaptive_procedure = {
+    'loss.high':   'staircase',
+    'loss.low':    'staircase',
+    'neutral':     'staircase',
+    'reward.high': 'staircase',
+    'reward.low':  'staircase',
+    }
+
+# Anchor every cue, target and feedback to its planned onset on runClock, as
+# set by the order file, by ending each fixation on the flip nearest the next
+# onset. Overshoot is absorbed by the next fixation instead of adding up over
+# the run. Planned vs actual onsets are saved either way.
+anchor_onsets = False
 
 
 total_earnings = 0
-total_earnings_goal = 40
+total_earnings_goal = scoring.total_earnings_goal
+trial_number = 0
 
 
 # accepted inputs
@@ -60,30 +102,10 @@ ttlKey = "5"
 expKeys = ["1","2","3","4"]
 escapeKeys = ["escape", "esc"]
 
+# order file columns saved with each trial
+order_columns = ['trial.type', 'fix.after.cue', 'fix.after.stim', 'fix.after.feedback']
 
 
-def is_final_run(r):
-    # We optionally nudge on the last run (-1 when counting from 0)
-    return r == num_runs - 1
-
-# Attempt to nudge rewards in a direction?
-# Note that both "range" and "nudge" are optional in the initialization screen
-def reward_for_range(r, nudge=False):
-    if not nudge:
-        items = list(range(r[0], r[1]+1))
-        return random.choice(items)
-    else:
-        def distance_to_goal(x):
-            return abs(total_earnings + x - total_earnings_goal)
-
-        d0 = distance_to_goal(r[0])
-        d1 = distance_to_goal(r[1])
-
-        if d0 < d1:
-            return r[0]
-        else:
-            return r[1]
-
 
 ## defining some initialization functions
 def make_screen():
@@ -128,9 +150,18 @@ def start_datafiles(_thisDir, expName, expInfo, data_dir, sn, fmri):
                 pad = 4-len(str(sn))
                 snstr = '0'*pad + str(sn)
                 fname = expName + '_'  + ['behavioral', 'fmri'][fmri] + '_' + snstr
-    filename = _thisDir + os.sep + data_dir + os.sep + fname
+    filename = os.path.join(_thisDir, data_dir, fname)
     return(filename)
 
+first_screen_time = None
+
+def first_screen_up():
+    """Log the time from the setup dialogs to the first screen, the first time"""
+    global first_screen_time
+    if first_screen_time is None:
+        first_screen_time = time.time()
+        logging.exp(f"Time to first screen: {first_screen_time - startup_time:.2f} s")
+
 def display_instructions_file(inst_file):
     instructions = []
     inname = _thisDir + os.sep + inst_dir + os.sep + inst_file
@@ -147,6 +178,7 @@ def display_instructions_file(inst_file):
         if instructLine == 0:
             instructFirst.draw()
             win.flip()
+            first_screen_up()
             instructRep = event.waitKeys(keyList=[forwardKey])
         else:
             instructMove.draw()
@@ -167,6 +199,16 @@ def display_instructions_file(inst_file):
 _thisDir = os.path.dirname(os.path.abspath(__file__))
 os.chdir(_thisDir)
 
+# start decoding the cue images now, they aren't needed until after the instructions
+cue_images = {
+    'reward.low':  "assets/gain1.png",
+    'reward.high': "assets/gain2.png",
+    'neutral':     "assets/neutral.png",
+    'loss.low':    "assets/loss1.png",
+    'loss.high':   "assets/loss2.png",
+    }
+images = ImageLoader(cue_images.values())
+
 # INITIALIZATION
 expName = expName + version
 expInfo = {
@@ -179,17 +221,30 @@ expInfo = {
     'use nudge for final run?': 'no',
     'do only a single behavioral practice run?': 'no',
     'start run (0-3)': '0',
+    'resume from checkpoint? (yes or no)': 'no',
     'staircase start reward.low':  '15',
     'staircase start reward.high': '15',
     'staircase start neutral':     '15',
     'staircase start loss.low':    '15',
     'staircase start loss.high':   '15',
 }
+# ask who it is first, so the staircase starts can come from their last session
+who = {'participant': expInfo['participant'], 'session': expInfo['session']}
+dlg = gui.DlgFromDict(dictionary=who, title=expName)
+if dlg.OK == False:
+    core.quit()  # user pressed cancel
+expInfo.update(who)
+previous_end = latest_staircase_end(session_db, int(who['participant']))
+if previous_end:
+    for k, v in previous_end.items():
+        expInfo['staircase start ' + k] = str(int(v))
 dlg = gui.DlgFromDict(dictionary=expInfo, title=expName)
 if dlg.OK == False:
     core.quit()  # user pressed cancel
+startup_time = time.time()  # to log how long it takes from here to the first screen
 expInfo['date'] = data.getDateStr()  # add a simple timestamp
 expInfo['expName'] = expName
+expInfo['total_earnings_goal'] = total_earnings_goal
 sn = int(expInfo['participant'])
 session = int(expInfo['session'])
 
@@ -216,16 +271,17 @@ else:
 
 start_run = int(expInfo['start run (0-3)'])
 
-if expInfo['use ranged rewards?'].lower() == 'yes':
-    reward_high = (5,7)
-    reward_low = (1,3)
-    loss_high = (-7,-5)
-    loss_low = (-3,-1)
+if expInfo['resume from checkpoint? (yes or no)'].lower() == 'yes':
+    resume = True
 else:
-    reward_high = (7,7)
-    reward_low = (1,1)
-    loss_high = (-7,-7)
-    loss_low = (-1,-1)
+    resume = False
+
+# Note that both "range" and "nudge" are optional in the initialization screen
+reward_ranges = scoring.reward_ranges(expInfo['use ranged rewards?'].lower() == 'yes')
+reward_high = reward_ranges['reward.high']
+reward_low = reward_ranges['reward.low']
+loss_high = reward_ranges['loss.high']
+loss_low = reward_ranges['loss.low']
 
 if expInfo['use nudge for final run?'].lower() == 'yes':
     nudge_final_run = True
@@ -235,9 +291,29 @@ else:
 # Data file name creation; later add .psyexp, .csv, .log, etc
 filename = start_datafiles(_thisDir, expName, expInfo, data_dir, sn, fmri)
 
-# An ExperimentHandler isn't essential but helps with data saving
-exp = data.ExperimentHandler(name=expName, version=version, extraInfo=expInfo, runtimeInfo=None,
-    originPath=None, savePickle=True, saveWideText=True, dataFileName=filename)
+# An ExperimentHandler isn't essential but helps with data saving. It's only
+# touched by a writer thread; `exp` collects rows and hands them over.
+if stream_output:
+    exp_handler = RowStreamWriter(filename + '.jsonl', extraInfo=expInfo)
+else:
+    exp_handler = data.ExperimentHandler(name=expName, version=version, extraInfo=expInfo, runtimeInfo=None,
+        originPath=None, savePickle=True, saveWideText=True, dataFileName=filename)
+exp = BackgroundRecorder(exp_handler)
+
+if fmri and bids_dir:
+    # a resumed run is a new scan, so its events go in their own files, as
+    # does a session run again (numbered, so earlier files are left alone)
+    bids_root = os.path.join(_thisDir, bids_dir)
+    bids_events = EventsWriter(bids_root, sn, session,
+                               acq=free_acq(bids_root, sn, session, 'resumed' if resume else None))
+    exp.add_listener(bids_events.write_trial)
+else:
+    bids_events = None
+
+# a checkpoint is added after every trial; read the last one before adding more
+checkpoint_file = checkpoint_path(data_dir, expName, fmri, sn, session)
+resume_state = load_latest(checkpoint_file) if resume else None
+checkpoint = Checkpoint(checkpoint_file)
 
 # save a log file for detail verbose info
 logFile = logging.LogFile(filename+'.log', level=logging.EXP)
@@ -250,12 +326,13 @@ xScr = float(win_res[0])/win_res[1]
 fontH = yScr/25
 wrapW = xScr/1.5
 text_color = 'white'
-# store frame rate of monitor if we can measure it
-expInfo['frameRate'] = win.getActualFrameRate()
+# store frame rate of monitor if we can measure it (or have before)
+expInfo['frameRate'], frame_rate_cached = frame_rate(win, win.monitor.name, frame_rate_cache, remeasure_frame_rate)
+logging.exp(f"Frame rate {expInfo['frameRate']} ({'cached' if frame_rate_cached else 'measured'})")
 if expInfo['frameRate'] != None and expInfo['frameRate'] < 300:
     frame_duration = 1.0 / round(expInfo['frameRate'])
 else:
-    frame_duration = 1.0 / 60.0  # could not measure, so guess
+    frame_duration = scoring.frame_duration  # could not measure, so guess
 
 # set random seed - participant and session dependent
 random.seed(sn * (session + 1000))
@@ -278,6 +355,12 @@ clock = core.Clock()
 instructPre = visual.TextStim(win, text="Please wait.\n\nThe task instructions will begin soon.",
                                      height=fontH, color=text_color, pos=[0, 0], wrapWidth=wrapW, flipHoriz=flipHoriz)
 
+# in the scanner, put this up straight away; everything below gets made while it's showing
+if fmri:
+    instructPre.draw()
+    win.flip()
+    first_screen_up()
+
 # Initialize components for Routine "instructions"
 instructPrompt = visual.TextStim(win=win, font='Arial', pos=(0, yScr/10), height=fontH, wrapWidth=wrapW, color=text_color, flipHoriz=flipHoriz);
 if fmri:
@@ -293,27 +376,33 @@ wait = visual.TextStim(win, pos=[0, 0], text="The task will begin momentarily. G
 endf = visual.TextStim(win, pos=[0, 0], text="Thank you. This part of the experiment is now complete.",wrapWidth=wrapW, height=fontH, color=text_color, flipHoriz=flipHoriz)
 
 # Initialize components for Routine "cue"
-cues = {
-    'reward.low':  visual.ImageStim(win, size=0.6, image="assets/gain1.png"),
-    'reward.high': visual.ImageStim(win, size=0.6, image="assets/gain2.png"),
-    'neutral':     visual.ImageStim(win, size=0.6, image="assets/neutral.png"),
-    'loss.low':    visual.ImageStim(win, size=0.6, image="assets/loss1.png"),
-    'loss.high':   visual.ImageStim(win, size=0.6, image="assets/loss2.png"),
-    }
-CueClock = core.Clock()
+# decoded at the size they're shown at, so drawing never has to resample them
+cue_size = 0.6
+cue_pixels = (cue_size * win.size[1], cue_size * win.size[1])
+cues = {k: visual.ImageStim(win, size=cue_size, image=images.get(path, cue_pixels)) for k, path in cue_images.items()}
+for path in cue_images.values():
+    if isinstance(images.get(path), str):
+        logging.warning(f"{path} couldn't be decoded ahead of time, so it's drawn from full size")
+logging.exp(f"Cue images decoded at {round(cue_pixels[0])}x{round(cue_pixels[1])} px")
 
 # Initialize components for Routine "Target"
-TargetClock = core.Clock()
 Target = visual.Rect(win,width=0.5, height=0.5, fillColor = "white", lineWidth=0, pos=(0,0))
 
 # Initialize components for Routine "Feedback"
-FeedbackClock = core.Clock()
-trial_feedback = visual.TextStim(win=win, name='trial_feedback',
-    text='Trial:', font='Arial', pos=(0, yScr/16), height=fontH+yScr/20, wrapWidth=None, ori=0,
-    color='White', colorSpace='rgb', opacity=1, flipHoriz=flipHoriz);
-exp_feedback = visual.TextStim(win=win, name='exp_feedback',
-    text='Total:', font='Arial', pos=(0, -yScr/16), height=fontH+yScr/20, wrapWidth=None, ori=0,
-    color='White', colorSpace='rgb', opacity=1, flipHoriz=flipHoriz);
+# every possible trial amount is rendered now; totals are rendered as they
+# come up and kept in a small cache
+feedback_text = FeedbackTextCache(win, [reward_high, reward_low, loss_high, loss_low],
+    trial_kwargs=dict(name='trial_feedback', font='Arial', pos=(0, yScr/16), height=fontH+yScr/20,
+        wrapWidth=None, ori=0, color='White', colorSpace='rgb', opacity=1, flipHoriz=flipHoriz),
+    total_kwargs=dict(name='exp_feedback', font='Arial', pos=(0, -yScr/16), height=fontH+yScr/20,
+        wrapWidth=None, ori=0, color='White', colorSpace='rgb', opacity=1, flipHoriz=flipHoriz))
+
+# what each routine in a timeline draws; feedback is picked per trial
+stims_by_name = {'fixation': (fix,), 'target': (Target,), 'feedback': None}
+stims_by_name.update((k, (v,)) for k, v in cues.items())
+
+# everything a trial draws, for warm_up to put on the GPU before it's needed
+trial_stims = list(cues.values()) + [Target, fix] + feedback_text.stims()
 
 breakPrompt = visual.TextStim(win, text="Take a break", height=fontH, color=text_color, pos=(0,0), flipHoriz=flipHoriz)
 breakEnd = visual.TextStim(win, text="Get ready", height=fontH, color=text_color, pos=(0,0), flipHoriz=flipHoriz)
@@ -322,7 +411,12 @@ breakEnd = visual.TextStim(win, text="Get ready", height=fontH, color=text_color
 globalClock = core.Clock()  # to track the time since experiment started
 runClock = core.Clock()  # to track the time since experiment started
 trialClock = core.Clock()  # to track the time since trial started
-routineTimer = core.CountdownTimer()  # to track time remaining of each (non-slip) routine
+
+# key presses, timestamped when the key goes down rather than when we poll
+keys = KeyInput()
+
+# flip timing, only hooked into win.flip if record_flips is on
+flips = FlipRecorder(win, frame_duration, enabled=record_flips)
 
 # create the staircase handlers to adjust for individual threshold
 # (stairs defined in units of screen frames; actual minimum presentation
@@ -334,75 +428,114 @@ if single:
     # Single mode to get the staircase numbers for the scanner run
     num_runs = 1
 
-if start_run == 0:
-    stepSizes = [6, 3, 3, 2, 2, 1, 1]
-else:
-    stepSizes = [2, 2, 1, 1]
-
 def make_stairs(nTrials, startVal=15.0):
+    # big steps when starting from the practice run, small ones otherwise;
+    # scoring.Staircase moves the same way for session_sim.py and replay.py
     return data.StairHandler(startVal=startVal,
         stepType='lin',
-        stepSizes=stepSizes,
-        minVal=0, maxVal=30,
-        nUp=1,
-        nDown=2, # will home in on the 66% threshold (nUp=1, nDown=3 homes in on 80%)
+        stepSizes=scoring.step_sizes(start_run),
+        minVal=scoring.min_val, maxVal=scoring.max_val,
+        nUp=scoring.n_up,
+        nDown=scoring.n_down, # will home in on the 66% threshold (nUp=1, nDown=3 homes in on 80%)
         nTrials=nTrials,
         extraInfo=expInfo)
 
-perStim = num_runs * num_trials / 6
+def make_quest(nTrials, startVal=15.0):
+    return QuestStaircase(startVal=startVal, nTrials=nTrials, minVal=scoring.min_val, maxVal=scoring.max_val)
+
+def make_adaptive(trial_type, nTrials):
+    startVal = int(expInfo['staircase start ' + trial_type])
+    if adaptive_procedure[trial_type] == 'quest':
+        return make_quest(nTrials, startVal)
+    return make_stairs(nTrials, startVal)
 
-stairs = {
-    'loss.high':   make_stairs(perStim,     int(expInfo['staircase start loss.high'])),
-    'loss.low':    make_stairs(perStim,     int(expInfo['staircase start loss.low'])),
-    'neutral':     make_stairs(perStim * 2, int(expInfo['staircase start neutral'])),
-    'reward.high': make_stairs(perStim,     int(expInfo['staircase start reward.high'])),
-    'reward.low':  make_stairs(perStim,     int(expInfo['staircase start reward.low'])),
-    }
 staircase_end = {}
 
 
 ## Useful functions
 
-def get_keypress():
-    keys = event.getKeys()
-    if keys:
-        return keys[0]
-    return None
-
 def shutdown():
     print("Logging staircase end values and exiting...")
-    stairs = ['loss.high', 'loss.low', 'neutral', 'reward.high', 'reward.low']
-    for k in stairs:
+    stair_names = ['loss.high', 'loss.low', 'neutral', 'reward.high', 'reward.low']
+    for k in stair_names:
         v = staircase_end.get(k, 15)
         logging.warning(f"Staircase end value for {k}: {v}")
 
     logging.warning(f"Total earnings: {total_earnings}")
 
-    logging.flush()
+    # hand over any rows still queued and flush the logs; if the writer
+    # thread failed this raises, but the files still get closed
+    try:
+        exp.close()
+    finally:
+        if stream_output:
+            exp_handler.close()
+        if bids_events:
+            bids_events.close()
+        checkpoint.close()
+    if staircase_end:
+        record_session(session_db, sn, session, fmri, trial_number, total_earnings, staircase_end,
+                       {k: get_state(v) for k, v in stairs.items()})
     win.close()
     core.quit()
 
+def checkpoint_state(next_run, next_trial):
+    """Everything needed to carry on from `next_trial` of `next_run`"""
+    return {
+        'run': next_run,
+        'trial': next_trial,
+        'trial_number': trial_number,
+        'total_earnings': total_earnings,
+        'order_files': [str(f) for f in order_files],
+        'staircase_end': dict(staircase_end),
+        'stairs': {k: get_state(v) for k, v in stairs.items()},
+        'random': random.getstate(),
+    }
+
+def escape():
+    logging.warning("Escape pressed, exiting early!")
+    shutdown()
+
+# every routine is played by this one loop; see timeline.py
+engine = RoutineEngine(win, keys, trialClock, frame_duration, expKeys, escapeKeys, escape)
+
 def show_stim(stim, duration):
-    duration = float(duration)
-    t_start = globalClock.getTime()
-    routineTimer.reset()
-    routineTimer.add(duration)
-    event.clearEvents(eventType='keyboard')
-    rt = None
-    while routineTimer.getTime() > 0:
-        key = get_keypress()
-        if key and key.lower() in escapeKeys:
-            logging.warning("Escape pressed, exiting early!")
-            shutdown()
-        if not rt and key in expKeys:
-            rt = duration - routineTimer.getTime()
-        if stim:
-            stim.draw()
-        win.flip()
-    return rt
+    return engine.play((stim,) if stim else (), frames_for(duration, frame_duration))
+
+def play(slot, stims=None, shown=None, frames=None):
+    """
+    Play one routine of the run's timeline: its own stimulus unless `stims`
+    are given, for its own length unless `frames` is. With anchor_onsets,
+    fixations last until the flip nearest their planned end.
+    """
+    name = routines[slot['routine']]
+    flips.set_context(routine=name)
+    if name != 'fixation':
+        win.callOnFlip(mark_onset, name)
+    if frames is None:
+        if anchor_onsets and name == 'fixation':
+            frames = engine.frames_until(slot['end'], runClock)
+        else:
+            frames = slot['frames']
+    if stims is None:
+        stims = run_stims[slot['stim']]
+    return engine.play(stims, frames, shown)
+
+def log_first_trial_flips(run):
+    # long intervals here would mean the warm-up missed something
+    intervals = win.frameIntervals
+    if intervals:
+        median = sorted(intervals)[len(intervals) // 2]
+        late = sum(i > 1.5 * frame_duration for i in intervals)
+        logging.exp(f"Run {run} first trial flips: {len(intervals)}, median {median * 1000:.2f} ms, "
+                    f"max {max(intervals) * 1000:.2f} ms, {late} late")
+    win.frameIntervals = []
+
+event_onsets = {}
 
-def show_fixation(duration):
-    return show_stim(fix, duration)
+def mark_onset(name):
+    # called on the flip an event starts on, with win.callOnFlip
+    event_onsets[name] = runClock.getTime()
 
 
 ## Displaying Instructions
@@ -416,35 +549,68 @@ if single:
 else:
     inst_file = "scanner_practice.txt"
 
+# first draws upload textures and compile shaders; do them unseen now
+warm_up(win, trial_stims)
+
 if fmri:
-    show_stim(instructPre, pre_instructions_duration)
+    # it's been up since the window opened
+    show_stim(instructPre, pre_instructions_duration - (time.time() - first_screen_time))
 
 display_instructions_file(inst_file)
 
 print("end of instructions, hit enter to continue")
-logging.flush()
+exp.flush()
 instructFinish.draw()
 win.flip()
 event.waitKeys(keyList=startKeys)
 
 print("instructions complete, continuing")
-logging.flush()
+exp.flush()
 
-# reset the non-slip timer for next routine
-routineTimer.reset()
 event.clearEvents(eventType='keyboard')
 
 
 ### PREP EXPERIMENTAL LOOP
 
-# load a list of the possible order files
-orders = list(Path(os.path.join(_thisDir, "orders")).glob("*.csv"))
-# pick random trial orders without replacement
-order_files = random.sample(orders, 4)
+if order_bank:
+    # orders come from the bank, picked by participant, session and run
+    bank = OrderBank(order_bank)
+    order_files = [bank.ref(bank.index_for(sn, session, r)) for r in range(num_runs)]
+else:
+    # load a list of the possible order files
+    orders = scoring.order_files(os.path.join(_thisDir, "orders"))
+    # pick random trial orders without replacement
+    order_files = scoring.pick_orders(orders, random)
+if resume and resume_state is not None:
+    order_files = resume_state['order_files']
+
+# each staircase gets as many trials as its type has over the session's orders
+stairs = {t: make_adaptive(t, n) for t, n in
+          scoring.trials_per_type(num_runs, load_order(order_files[0])).items()}
+
+# pick up after the last finished trial
+first_trial = 0
+if resume and resume_state is None:
+    logging.warning(f"No checkpoint in {checkpoint_file}, starting at run {start_run}")
+elif resume:
+    start_run = resume_state['run']
+    first_trial = resume_state['trial']
+    trial_number = resume_state['trial_number']
+    total_earnings = resume_state['total_earnings']
+    staircase_end.update(resume_state['staircase_end'])
+    for k, state in resume_state['stairs'].items():
+        set_state(stairs[k], state)
+    restore_random(resume_state['random'])
+    if first_trial >= num_trials:
+        # stopped during the end of a run; carry on as it would have
+        total_earnings = scoring.total_after_run(start_run, total_earnings, single)
+        start_run += 1
+        first_trial = 0
+    logging.warning(f"Resuming at run {start_run}, trial {first_trial + 1} "
+                    f"(trial number {trial_number + 1}), total earnings {total_earnings}")
 
 
 # EXPERIMENT BEGINS
-trial_number = 0
 
 def speed_up(duration):
     return float(duration) * single_speed_factor
@@ -453,15 +619,20 @@ def speed_up(duration):
 # Loop the rest of this for num_runs
 for run in range(start_run, num_runs):
     order_file = order_files[run]
-    order = csv.DictReader(open(order_file))
-    order = list(order)
+    if order_bank:
+        order = bank.order(bank.index_for(sn, session, run))
+    else:
+        order = read_order_csv(order_file)
     exp.addData('run.order.file', order_file)
     if DEBUG:
         print(f'order_file is {order_file}')
 
+    # again before the wait, in case anything was evicted over the instructions or break
+    warm_up(win, trial_stims)
+
     if fmri:
         print(f"waiting for ready, hit {startKeys} after prep scan")
-        logging.flush()
+        exp.flush()
         wait.draw()
         win.flip()
         event.waitKeys(keyList=startKeys)
@@ -469,7 +640,7 @@ for run in range(start_run, num_runs):
     # Wait for TR signal if in scanner
     if triggerOnTTL:
         print(f"waiting for TTL key {ttlKey} on TR")
-        logging.flush()
+        exp.flush()
         wait.draw()
         win.flip()
         event.waitKeys(keyList=ttlKey)
@@ -477,9 +648,10 @@ for run in range(start_run, num_runs):
 
 
     print(f"starting run {run + 1} of {num_runs}")
-    logging.flush()
+    exp.flush()
 
     runClock.reset()
+    flips.start_run(run)
     if run == 0:
         globalClock.reset() # to align actual time with virtual time keeper
     exp.addData('run.system.seconds_since_epoch', time.time())
@@ -489,12 +661,28 @@ for run in range(start_run, num_runs):
     if DEBUG:
         print(f"actual start {globalClock.getTime()}")
 
-    # present initial fixation
+    # present initial fixation, a good time to write out the logs
+    exp.flush()
     if run == 0:
         initial_fix_duration = speed_up(initial_fix_duration)
-    show_fixation(initial_fix_duration)
-
-    for trial in range(0, num_trials):
+    # a resumed run starts part way through its order
+    run_first_trial = first_trial if run == start_run else 0
+    # every routine's stimulus and length for the rest of the run
+    timeline, stim_names = compile_run(
+        order, run_first_trial, scoring.trial_types, frame_duration, initial_fix_duration,
+        cue_time, max_target_dur, feedback_time, single_speed_factor if run == 0 else 1.0)
+    run_stims = [stims_by_name[n] for n in stim_names]
+    earnings_controller = None
+    if scoring.should_nudge(nudge_final_run, run, num_runs):
+        # plan rewards for the rest of the run toward the goal
+        earnings_controller = scoring.earnings_controller(
+            [t['trial.type'] for t in order[run_first_trial:]],
+            reward_ranges, stairs, total_earnings_goal, total_earnings)
+        logging.exp(f"Earnings controller: expected distance from goal {earnings_controller.expected_distance:.2f}")
+
+    play(timeline[0])
+
+    for trial in range(run_first_trial, num_trials):
         if DEBUG:
             print(f'trial {trial + 1} of {num_trials}')
 
@@ -504,6 +692,8 @@ for run in range(start_run, num_runs):
         trial_type = trial_details['trial.type']
 
         trial_stairs = stairs[trial_type]
+        if trial == run_first_trial:
+            win.recordFrameIntervals = True
 
         trial_duration_frames = trial_stairs.next()
         staircase_end[trial_type] = trial_duration_frames
@@ -520,115 +710,61 @@ for run in range(start_run, num_runs):
         exp.addData('time.onset', globalClock.getTime())
 
 
-        def log_detail(x):
-            print(f"{x}: {trial_details[x]}")
         if DEBUG:
-            log_detail('fix.after.cue')
-            log_detail('fix.after.stim')
-            log_detail('fix.after.feedback')
-            log_detail('trial.type')
+            for x in order_columns:
+                print(f"{x}: {trial_details[x]}")
 
-        cue = cues[trial_type]
+        # this trial's six routines, from the run's timeline
+        cue_slot, fix_cue_slot, target_slot, fix_stim_slot, feedback_slot, fix_feedback_slot = \
+            trial_slots(timeline, trial)
 
         if DEBUG:
             print('time before cue: ', trialClock.getTime())
 
-        cue_rt = show_stim(cue, cue_time)
+        flips.set_context(trial=trial_number)
+        cue_rt = play(cue_slot)
         if cue_rt:
             exp.addData('trial.cue_rt', cue_rt)
 
         if DEBUG:
             print('time after cue: ', trialClock.getTime())
 
-        fix_after_cue = trial_details['fix.after.cue']
-        if run == 0:
-            fix_after_cue = speed_up(fix_after_cue)
-        too_fast_rt = show_fixation(fix_after_cue)
+        too_fast_rt = play(fix_cue_slot)
         if too_fast_rt:
             exp.addData('trial.too_fast_rt', too_fast_rt)
 
         if DEBUG:
             print('time after first fix: ', trialClock.getTime())
 
-        # ------Prepare to start Routine "Target"-------
-        t = 0
-        TargetClock.reset()  # clock
-
-        # reset the non-slip timer for next routine
-        routineTimer.reset()
-        continueRoutine = True
-        # Maximum time allowed for target response
-        routineTimer.add(max_target_dur)
-
-        # update component parameters for each repeat
-        target_response = event.BuilderKeyResponse()
-        trial_response = 0
-        rt = None
-
-        # keep track of which components have finished
-        TargetComponents = [Target, target_response]
-        for thisComponent in TargetComponents:
-            if hasattr(thisComponent, 'status'):
-                thisComponent.status = NOT_STARTED
-
-        # -------Start Routine "Target"-------
-        while continueRoutine and routineTimer.getTime() > 0:
-            # get current time
-            t = TargetClock.getTime()
-
-            # selection screen updates
-            if t >= 0.0 and Target.status == NOT_STARTED:
-                stim_duration = min_target_dur + frame_duration * trial_duration_frames
-                # keep track of start time/frame for later
-                Target.tStart = t
-                # display target
-                Target.setAutoDraw(True)
-                # open response options
-                target_response.tStart = t
-                target_response.status = STARTED
-                # keyboard checking is just starting
-                win.callOnFlip(target_response.clock.reset)  # t=0 on next screen flip
-                event.clearEvents(eventType='keyboard')
-                theseKeys = []
-
-            stim_duration = min_target_dur + frame_duration * trial_duration_frames
-            if Target.status == STARTED and t >= stim_duration:
-                if DEBUG:
-                    print('trial_duration_frames:', trial_duration_frames)
-                    print('frame_duration:', frame_duration)
-                    print('stim_duration:', stim_duration)
-
-                Target.setAutoDraw(False)
-                theseKeys = event.getKeys(keyList=expKeys)
-
-                if len(theseKeys) > 0:  # at least one key was pressed
-                    trial_response = 1
-                    rt = target_response.clock.getTime()
-                    target_response.rt = rt
-
-            # check if all components have finished
-            if not continueRoutine:
-                break
-            continueRoutine = False
-            for thisComponent in TargetComponents:
-                if hasattr(thisComponent, "status") and thisComponent.status != FINISHED:
-                    continueRoutine = True
-                    break  # at least one component has not yet finished
-
-            # draw fixation if we're done, so we don't leave a blank screen for any frames
-            if not continueRoutine:
-                fix.draw()
-            win.flip()
+        # Target: up for a counted number of flips, always coming down inside
+        # the response window so the keys get checked
+        stim_duration = scoring.stim_duration(trial_duration_frames, frame_duration, min_target_dur)
+        target_flips = scoring.target_flips(stim_duration, frame_duration, max_target_dur)
+        if DEBUG:
+            print('trial_duration_frames:', trial_duration_frames)
+            print('target_flips:', target_flips)
+
+        rt = play(target_slot, shown=target_flips)
+        target_on = engine.times[0]
+        target_off = engine.times[target_flips]  # first flip with the target gone
+        # the first press in the response window, whether or not it counts
+        exp.addData('trial.target.press_rt', rt)
+        # only presses while the target was up count
+        if rt is not None and rt < target_off - target_on:
+            trial_response = 1
+        else:
+            trial_response = 0
+            rt = None
 
-        # -------Ending Routine "Target"-------
-        for thisComponent in TargetComponents:
-            if hasattr(thisComponent, "setAutoDraw"):
-                thisComponent.setAutoDraw(False)
+        exp.addData('trial.target.flips', target_flips)
+        exp.addData('trial.target.on', target_on)
+        exp.addData('trial.target.off', target_off)
+        exp.addData('trial.target.measured_duration', target_off - target_on)
 
         if DEBUG:
             print('time after target: ', trialClock.getTime())
 
-        if (cue_rt or too_fast_rt) and trial_response:
+        if scoring.too_fast(trial_response, cue_rt, too_fast_rt):
             # Fail them if they are button mashing too early
             trial_response = 0
             print("response: too fast")
@@ -636,46 +772,43 @@ for run in range(start_run, num_runs):
         # add the data to the current staircase so it can be used to calculate the next level
         trial_stairs.addResponse(trial_response)
         exp.addData("trial.response", trial_response)
+        if adaptive_procedure[trial_type] == 'quest':
+            quest_summary = trial_stairs.summary()
+            for k, v in quest_summary.items():
+                exp.addData(f'trial.quest.{k}', v)
+            logging.exp(f"{trial_type} threshold posterior: mean {quest_summary['mean']:.2f}, "
+                        f"sd {quest_summary['sd']:.2f}, mode {quest_summary['mode']:.2f} frames")
         exp.addData('trial.staircase_stim_duration', stim_duration)
 
         # check responses to add RT
         if trial_response:
-            exp.addData('trial.rt', target_response.rt)
-            exp.addData('trial.stim_duration', target_response.rt)
-            print(f"response: {target_response.rt}")
+            exp.addData('trial.rt', rt)
+            exp.addData('trial.stim_duration', rt)
+            print(f"response: {rt}")
         else:
             exp.addData('trial.stim_duration', stim_duration)
             print(f"response: none during stim")
-        logging.flush()
 
-        reward = 0
-        should_nudge = nudge_final_run and is_final_run(run)
+        should_nudge = earnings_controller is not None
         exp.addData('trial.should_nudge', should_nudge)
 
-        # update trial components
-        if trial_type == 'reward.high':
-            if trial_response:
-                reward = reward_for_range(reward_high, should_nudge)
-        elif trial_type == 'reward.low':
-            if trial_response:
-                reward = reward_for_range(reward_low, should_nudge)
-        elif trial_type == 'loss.high':
-            if not trial_response:
-                reward = reward_for_range(loss_high, should_nudge)
-        elif trial_type == 'loss.low':
-            if not trial_response:
-                reward = reward_for_range(loss_low, should_nudge)
+        # drawn from the type's range, or the lookahead controller's pick
+        # from tables built at the start of the run
+        reward = scoring.trial_reward(trial_type, trial_response, reward_ranges, random,
+                                      earnings_controller, trial - run_first_trial, total_earnings)
 
         exp.addData('trial.reward', reward)
         total_earnings += reward
         if DEBUG:
             print(f"{trial_type} result: {trial_response}, reward is {reward} for total {total_earnings}" )
 
+        # look up the feedback text now, so any rendering happens before the
+        # fixation rather than on the first feedback frame
+        trial_feedback = feedback_text.trial_text(reward)
+        exp_feedback = feedback_text.total_text(total_earnings)
+
         # Fixation after stim target
-        fix_after_stim = trial_details['fix.after.stim']
-        if run == 0:
-            fix_after_stim = speed_up(fix_after_stim)
-        too_slow_rt = show_fixation(fix_after_stim)
+        too_slow_rt = play(fix_stim_slot)
         if too_slow_rt:
             print("response: too slow")
             exp.addData('trial.too_slow_rt', too_slow_rt)
@@ -683,116 +816,69 @@ for run in range(start_run, num_runs):
         if DEBUG:
             print('time after second fix: ', trialClock.getTime())
 
-        # ------Prepare to start Routine "Feedback"-------
-        t = 0
-        FeedbackClock.reset()  # clock
-        # reset the non-slip timer for next routine
-        routineTimer.reset()
-        continueRoutine = True
-        routineTimer.add(feedback_time)
-
-        def trial_cash_string(r):
-            if r > 0:
-                return f"+${r}.00"
-            elif r < 0:
-                return f"-${r * -1}.00"
-            else:
-                return f"${r}.00"
-
-        def total_cash_string(r):
-            if r < 0:
-                return f"-${r * -1}.00"
-            else:
-                return f"${r}.00"
-
-        trial_feedback.setText(trial_cash_string(reward))
-        exp_feedback.setText('[' + total_cash_string(total_earnings) + ']')
-
         exp.addData('total_earnings', total_earnings)
-
-        # keep track of which components have finished
-        FeedbackComponents = [trial_feedback, exp_feedback]
-        for thisComponent in FeedbackComponents:
-            if hasattr(thisComponent, 'status'):
-                thisComponent.status = NOT_STARTED
-
-        # -------Start Routine "Feedback"-------
-        while continueRoutine and routineTimer.getTime() > 0:
-            # get current time
-            t = FeedbackClock.getTime()
-
-            # feedback screen updates
-            if t >= 0.0 and trial_feedback.status == NOT_STARTED:
-                # keep track of start time/frame for later
-                trial_feedback.tStart = t
-                trial_feedback.setAutoDraw(True)
-                exp_feedback.setAutoDraw(True)
-            frameRemains = 0.0 + feedback_time - win.monitorFramePeriod * 0.75  # most of one frame period left
-            if trial_feedback.status == STARTED and t >= frameRemains:
-                trial_feedback.setAutoDraw(False)
-                exp_feedback.setAutoDraw(False)
-
-            # check if all components have finished
-            if not continueRoutine:
-                break
-            continueRoutine = False
-            for thisComponent in FeedbackComponents:
-                if hasattr(thisComponent, "status") and thisComponent.status != FINISHED:
-                    continueRoutine = True
-                    break  # at least one component has not yet finished
-
-            # refresh the screen
-            if continueRoutine:  # don't flip if this routine is over or we'll get a blank screen
-                win.flip()
-
-        # -------Ending Routine "Feedback"-------
-        for thisComponent in FeedbackComponents:
-            if hasattr(thisComponent, "setAutoDraw"):
-                thisComponent.setAutoDraw(False)
+        play(feedback_slot, (trial_feedback, exp_feedback))
 
         if DEBUG:
             print('time after feedback: ', trialClock.getTime())
 
-        # Fixation after stim target
+        # Fixation after feedback
         # We want this to be altered so that the length
         # of the trial is adjusted by the stim difference from 0.5s...
-
-        trial_time = trialClock.getTime()
         fix_after_feedback_adjusted = float(trial_details['fix.after.feedback'])
         if rt:
             difference_between_rt_and_original = max_target_dur - rt
             fix_after_feedback_adjusted += difference_between_rt_and_original
         if run == 0:
             fix_after_feedback_adjusted = speed_up(fix_after_feedback_adjusted)
-        show_fixation(fix_after_feedback_adjusted)
+        # quiet stretch at the end of the trial, write out the logs
+        exp.flush()
+        if anchor_onsets:
+            # the next cue is anchored too, so no RT adjustment needed
+            fix_after_feedback_adjusted = fix_feedback_slot['end'] - runClock.getTime()
+            play(fix_feedback_slot)
+        else:
+            play(fix_feedback_slot, frames=frames_for(fix_after_feedback_adjusted, frame_duration))
 
         if DEBUG:
             print('time after final fix: ', trialClock.getTime())
 
         # completed trial, add some data to log file
         exp.addData('fix.after.feedback.adjusted', fix_after_feedback_adjusted)
+        # planned vs actual onsets, on runClock
+        errors = []
+        for name, slot in (('cue', cue_slot), ('target', target_slot), ('feedback', feedback_slot)):
+            planned = slot['onset']
+            actual = event_onsets[name]
+            exp.addData(f'time.{name}.onset', actual)
+            exp.addData(f'time.{name}.planned', planned)
+            exp.addData(f'time.{name}.error', actual - planned)
+            errors.append(f"{name} {(actual - planned) * 1000:+.1f} ms")
+        logging.exp(f"Trial {trial_number} onset error: " + ", ".join(errors))
         exp.addData('time.trial', trialClock.getTime())
         exp.addData('time.run', runClock.getTime())
         exp.addData('time.global', globalClock.getTime())
         exp.addData('subid', sn)
         exp.addData('session', session)
         exp.addData('run', run)
-        def add_detail(x):
+        for x in order_columns:
             exp.addData(x, trial_details[x])
-        add_detail('trial.type')
-        add_detail('fix.after.cue')
-        add_detail('fix.after.stim')
-        add_detail('fix.after.feedback')
 
         # advance to next trial/line in logFile
         exp.nextEntry()
-
+        exp.call(checkpoint.write, checkpoint_state(run, trial + 1))
+        if trial == run_first_trial:
+            win.recordFrameIntervals = False
+            log_first_trial_flips(run)
+
+    # the run's own flips, without the break or instructions after it
+    flips.write_run(filename, run)
+    flips.set_context(routine='other')
     if single:
         print("Run complete")
     elif run == 0:
         # If done with the practice run, show the post-practice stuff
         display_instructions_file("scanner_postpractice.txt")
-        total_earnings = 0
     elif run < num_runs - 1:
         # If we are still going and NOT on the last run, show the break messages
         show_stim(breakPrompt, 2)
@@ -801,6 +887,9 @@ for run in range(start_run, num_runs):
     else:
         # We are on the last run
         show_stim(None, closing_duration)
+    total_earnings = scoring.total_after_run(run, total_earnings, single)
+
+    exp.call(checkpoint.write, checkpoint_state(run + 1, 0))
 
 
 # completed experimental phase
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+orderbank.py
+
+A compiled bank of trial orders, so mid.py doesn't have to glob and parse
+CSVs in `orders/` for every run.
+
+A bank is a single .npy file holding one fixed-width record per order: the
+order's id (the `simnum` column), its trial types as small integer codes,
+and its three fixation columns. The file is memory-mapped, so picking an
+order is an index into it rather than a parse, and banks can hold as many
+orders as we like.
+
+Orders are picked deterministically from (participant, session, run). Keys
+are spread over the bank with a stride that's coprime with its size, so as
+long as the bank has more orders than participant/session/run keys, no two
+runs ever share an order.
+
+    python orderbank.py build orders/*.csv -o orders/bank.npy
+    python orderbank.py show orders/bank.npy --participant 12 --session 1
+"""
+import argparse
+import csv
+import math
+import os
+
+import numpy as np
+
+trial_types = ['neutral', 'reward.high', 'reward.low', 'loss.high', 'loss.low']
+
+fixation_columns = {
+    'fix.after.cue': 'fix_cue',
+    'fix.after.stim': 'fix_stim',
+    'fix.after.feedback': 'fix_feedback',
+}
+
+# used to turn (participant, session, run) into one key; sessions beyond
+# this share keys with the next participant
+max_sessions = 10
+max_runs = 4
+
+# a large prime, nudged if it happens to divide the bank size
+default_stride = 2654435761
+
+
+def order_dtype(num_trials):
+    return np.dtype([
+        ('simnum', np.int64),
+        ('type', np.int8, (num_trials,)),
+        ('fix_cue', np.float64, (num_trials,)),
+        ('fix_stim', np.float64, (num_trials,)),
+        ('fix_feedback', np.float64, (num_trials,)),
+    ])
+
+
+def read_order_csv(path):
+    """Rows of an order CSV as dicts, same as csv.DictReader gives"""
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def build(csv_paths, out):
+    """Compile order CSVs into a bank at `out`; returns the number of orders"""
+    orders = [read_order_csv(p) for p in csv_paths]
+    num_trials = len(orders[0])
+    bank = np.zeros(len(orders), dtype=order_dtype(num_trials))
+    for i, (path, rows) in enumerate(zip(csv_paths, orders)):
+        if len(rows) != num_trials:
+            raise ValueError(f"{path} has {len(rows)} trials, expected {num_trials}")
+        simnum = rows[0].get('simnum') or os.path.splitext(os.path.basename(path))[0]
+        bank[i]['simnum'] = int(simnum)
+        bank[i]['type'] = [trial_types.index(r['trial.type']) for r in rows]
+        for column, field in fixation_columns.items():
+            bank[i][field] = [float(r[column]) for r in rows]
+    np.save(out, bank)
+    return len(bank)
+
+
+class OrderBank:
+    """A memory-mapped order bank"""
+
+    def __init__(self, path):
+        self.path = path
+        self.orders = np.load(path, mmap_mode='r')
+        self.stride = default_stride
+        while math.gcd(self.stride, len(self.orders)) != 1:
+            self.stride += 2
+
+    def __len__(self):
+        return len(self.orders)
+
+    def index_for(self, participant, session, run):
+        key = (participant * max_sessions + session) * max_runs + run
+        return (key * self.stride) % len(self.orders)
+
+    def order(self, index):
+        """Order `index` as a list of dicts, like the rows of an order CSV"""
+        o = self.orders[index]
+        return [
+            {
+                'simnum': int(o['simnum']),
+                'trial.type': trial_types[t],
+                'fix.after.cue': float(o['fix_cue'][i]),
+                'fix.after.stim': float(o['fix_stim'][i]),
+                'fix.after.feedback': float(o['fix_feedback'][i]),
+            }
+            for i, t in enumerate(o['type'])
+        ]
+
+    def ref(self, index):
+        """A string naming this order, for `run.order.file`"""
+        return f"{self.path}#{index}"
+
+    def select(self, participant, session, run):
+        """(ref, order) for this participant, session and run"""
+        index = self.index_for(participant, session, run)
+        return self.ref(index), self.order(index)
+
+
+def load_order(ref):
+    """
+    Load an order from whatever was recorded in `run.order.file`: either a
+    CSV path or a `bank.npy#index` reference.
+    """
+    ref = str(ref)
+    if '#' in ref:
+        path, index = ref.rsplit('#', 1)
+        return OrderBank(path).order(int(index))
+    return read_order_csv(ref)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    b = sub.add_parser('build', help='compile order CSVs into a bank')
+    b.add_argument('csvs', nargs='+')
+    b.add_argument('-o', '--out', default=os.path.join('orders', 'bank.npy'))
+
+    s = sub.add_parser('show', help='show which orders a participant/session gets')
+    s.add_argument('bank')
+    s.add_argument('--participant', type=int, required=True)
+    s.add_argument('--session', type=int, required=True)
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        n = build(sorted(args.csvs), args.out)
+        print(f"wrote {n} orders to {args.out}")
+    else:
+        bank = OrderBank(args.bank)
+        for run in range(max_runs):
+            index = bank.index_for(args.participant, args.session, run)
+            order = bank.order(index)
+            print(f"run {run}: order {index} (simnum {order[0]['simnum']})")
+
+
+if __name__ == '__main__':
+    main()
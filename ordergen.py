@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+ordergen.py
+
+Generates trial orders for mid.py, in the same CSV format as `orders/`.
+
+Candidate designs are random shufflings of the trial-type mix with random
+fixation jitters. Each candidate's event timings are turned into a design
+matrix (cue and feedback regressors per trial type and one target
+regressor, convolved with the canonical double-gamma HRF and sampled every
+TR) and scored by its estimation efficiency for contrasts of each
+non-neutral condition against neutral. Candidates are scored in batches as
+stacked arrays, and batches are spread over a process pool; the best
+designs are written out.
+
+mid.py picks from every order in `orders/` and sizes each trial type's
+staircase from the mix in one of them, so they all have to have the same
+length and mix of types. New orders go to their own directory, and won't be
+added to one that has orders with a different mix.
+
+    python ordergen.py --num-trials 30 --count 12 --candidates 100000 --out orders_new
+    python ordergen.py --num-trials 24 --mix neutral=8 reward.high=4 reward.low=4 loss.high=4 loss.low=4
+"""
+import argparse
+import csv
+import glob
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scoring import cue_time, feedback_time, max_target_dur
+
+trial_types = ['neutral', 'reward.high', 'reward.low', 'loss.high', 'loss.low']
+
+# Timing of the existing orders: first cue at 5 s, fixations drawn from
+# these ranges, and a long fixation after the last trial
+first_onset = 5.0
+fix_after_cue_range = (2.0, 2.75)
+fix_after_stim_range = (2.0, 2.75)
+fix_after_feedback_range = (3.0, 5.0)
+final_fixation = 18.0
+
+tr = 2.0
+dt = 0.1  # resolution the HRF responses are computed at
+batch_size = 256
+
+
+def default_mix(num_trials):
+    """Same proportions as the existing orders: a third neutral, a sixth of each other type"""
+    if num_trials % 6:
+        raise ValueError(f"{num_trials} trials can't be split like the existing orders, give a --mix")
+    sixth = num_trials // 6
+    return {'neutral': 2 * sixth, 'reward.high': sixth, 'reward.low': sixth,
+            'loss.high': sixth, 'loss.low': sixth}
+
+
+def canonical_hrf(dt, length=32.0):
+    """SPM's double-gamma HRF sampled every `dt` seconds"""
+    t = np.arange(0, length, dt)
+    peak = t ** 5 * np.exp(-t) / math.gamma(6)
+    undershoot = t ** 15 * np.exp(-t) / math.gamma(16)
+    h = peak - undershoot / 6
+    return h / h.sum()
+
+
+def contrasts():
+    """
+    Each non-neutral condition against neutral, for both cue and feedback.
+    Columns: 5 cue regressors, target, 5 feedback regressors, intercept.
+    """
+    n = len(trial_types)
+    rows = []
+    for offset in (0, n + 1):
+        for i in range(1, n):
+            c = np.zeros(2 * n + 2)
+            c[offset + i] = 1
+            c[offset] = -1
+            rows.append(c)
+    return np.array(rows)
+
+
+def random_designs(rng, n, mix, num_trials):
+    """n random designs: trial type codes and the three fixation columns"""
+    base = np.repeat(np.arange(len(trial_types)), [mix.get(t, 0) for t in trial_types])
+    types = rng.permuted(np.tile(base, (n, 1)), axis=1)
+    fix_cue = rng.uniform(*fix_after_cue_range, (n, num_trials))
+    fix_stim = rng.uniform(*fix_after_stim_range, (n, num_trials))
+    fix_feedback = rng.uniform(*fix_after_feedback_range, (n, num_trials))
+    fix_feedback[:, -1] = final_fixation
+    return types, fix_cue, fix_stim, fix_feedback
+
+
+def onsets(fix_cue, fix_stim, fix_feedback):
+    """Cue, target and feedback onsets for each trial, in seconds from the start of the order"""
+    trial_length = cue_time + fix_cue + max_target_dur + fix_stim + feedback_time + fix_feedback
+    ons_cue = np.empty_like(fix_cue)
+    ons_cue[:, 0] = first_onset
+    ons_cue[:, 1:] = first_onset + np.cumsum(trial_length, axis=1)[:, :-1]
+    ons_stim = ons_cue + cue_time + fix_cue
+    ons_feedback = ons_stim + max_target_dur + fix_stim
+    return ons_cue, ons_stim, ons_feedback
+
+
+def event_response(duration, hrf):
+    """HRF response to one event of `duration` seconds, sampled every dt"""
+    return np.convolve(np.ones(int(round(duration / dt))), hrf)
+
+
+def efficiency(types, fix_cue, fix_stim, fix_feedback, hrf, c, tr=tr):
+    """Estimation efficiency, 1 / trace(C (X'X)^-1 C'), for each design"""
+    n, num_trials = types.shape
+    n_types = len(trial_types)
+    n_regressors = 2 * n_types + 1
+    ons_cue, ons_stim, ons_feedback = onsets(fix_cue, fix_stim, fix_feedback)
+    run_length = ons_feedback[:, -1] + feedback_time + fix_feedback[:, -1]
+    scans = np.arange(int(math.ceil(run_length.max() / tr))) * tr
+
+    # Each regressor is the sum of its events' responses, so instead of
+    # building boxcars and convolving, look up every event's response at
+    # every scan and add them into their regressor's column
+    x = np.zeros((n, n_regressors, len(scans)))
+    columns = np.arange(n_regressors)
+    for column, ons, duration in (
+            (types, ons_cue, cue_time),
+            (np.full_like(types, n_types), ons_stim, max_target_dur),
+            (types + n_types + 1, ons_feedback, feedback_time)):
+        g = event_response(duration, hrf)
+        lag = np.round((scans - ons[:, :, None]) / dt).astype(np.int64)
+        response = np.where((lag >= 0) & (lag < len(g)), g[np.clip(lag, 0, len(g) - 1)], 0)
+        x += np.einsum('nts,ntr->nrs', response, (column[:, :, None] == columns).astype(x.dtype))
+
+    # scans past the end of a shorter design's run don't exist
+    in_run = scans <= run_length[:, None]
+    x = np.where(in_run[:, None, :], x, 0)
+    x = np.concatenate([x, in_run[:, None, :].astype(x.dtype)], axis=1)
+
+    xtx = np.einsum('nrt,nst->nrs', x, x)
+    inv = np.linalg.pinv(xtx)
+    return 1.0 / np.einsum('cr,nrs,cs->n', c, inv, c)
+
+
+def search_batches(seed, n_batches, mix, num_trials, keep, tr=tr):
+    """Score `n_batches` batches of random designs; return the best `keep` of them"""
+    rng = np.random.default_rng(seed)
+    hrf = canonical_hrf(dt)
+    c = contrasts()
+    best = None
+    for _ in range(n_batches):
+        designs = random_designs(rng, batch_size, mix, num_trials)
+        eff = efficiency(*designs, hrf, c, tr)
+        candidates = (eff,) + designs
+        if best is not None:
+            candidates = tuple(np.concatenate([a, b]) for a, b in zip(best, candidates))
+        top = np.argsort(candidates[0])[::-1][:keep]
+        best = tuple(a[top] for a in candidates)
+    return best
+
+
+def search(count, n_candidates, mix, num_trials, workers=None, seed=None, tr=tr):
+    """Search `n_candidates` random designs over a process pool; return the best `count`"""
+    n_batches = max(1, n_candidates // batch_size)
+    workers = workers or os.cpu_count() or 1
+    per_worker = [n_batches // workers + (i < n_batches % workers) for i in range(workers)]
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(search_batches, s, b, mix, num_trials, count, tr)
+                   for s, b in zip(seeds, per_worker) if b]
+        results = [f.result() for f in futures]
+    merged = tuple(np.concatenate(parts) for parts in zip(*results))
+    top = np.argsort(merged[0])[::-1][:count]
+    return tuple(a[top] for a in merged)
+
+
+def write_order(path, simnum, types, fix_cue, fix_stim, fix_feedback):
+    ons_cue, ons_stim, ons_feedback = onsets(fix_cue[None], fix_stim[None], fix_feedback[None])
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['simnum', 'trial.type', 'ons.cue', 'ons.stim', 'ons.feedback',
+                         'fix.after.cue', 'fix.after.stim', 'fix.after.feedback'])
+        for i, t in enumerate(types):
+            writer.writerow([simnum, trial_types[t], ons_cue[0, i], ons_stim[0, i], ons_feedback[0, i],
+                             fix_cue[i], fix_stim[i], fix_feedback[i]])
+
+
+def next_simnum(out):
+    existing = [os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(out, '*.csv'))]
+    existing = [int(s) for s in existing if s.isdigit()]
+    return max(existing + [9999]) + 1
+
+
+def order_mixes(out):
+    """The mixes of trial types in the order CSVs already in `out`, as sorted (type, count) tuples"""
+    mixes = set()
+    for path in glob.glob(os.path.join(out, '*.csv')):
+        with open(path, newline='') as f:
+            types = [row['trial.type'] for row in csv.DictReader(f) if row.get('trial.type')]
+        mixes.add(tuple(sorted((t, types.count(t)) for t in set(types))))
+    return mixes
+
+
+def describe_mix(mix):
+    return ' '.join(f"{t}={n}" for t, n in mix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--num-trials', type=int, default=30)
+    parser.add_argument('--mix', nargs='+', metavar='TYPE=N',
+                        help='trials of each type, e.g. neutral=10 reward.high=5 (default: same proportions as the existing orders)')
+    parser.add_argument('--count', type=int, default=12, help='orders to write')
+    parser.add_argument('--candidates', type=int, default=100000, help='random designs to search')
+    parser.add_argument('--tr', type=float, default=tr)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--out', default='orders_new', help='directory to write order CSVs to')
+    args = parser.parse_args()
+
+    if args.mix:
+        mix = {}
+        for item in args.mix:
+            t, n = item.split('=')
+            if t not in trial_types:
+                parser.error(f"unknown trial type {t}")
+            mix[t] = int(n)
+    else:
+        try:
+            mix = default_mix(args.num_trials)
+        except ValueError as e:
+            parser.error(str(e))
+    if sum(mix.values()) != args.num_trials:
+        parser.error(f"mix adds up to {sum(mix.values())} trials, not {args.num_trials}")
+
+    this_mix = tuple(sorted((t, n) for t, n in mix.items() if n))
+    other = order_mixes(args.out) - {this_mix}
+    if other:
+        parser.error(f"{args.out} already has orders with {'; '.join(describe_mix(m) for m in sorted(other))}; "
+                     f"mid.py sizes its staircases from one order, so write to another directory")
+
+    eff, types, fix_cue, fix_stim, fix_feedback = search(
+        args.count, args.candidates, mix, args.num_trials, args.workers, args.seed, args.tr)
+
+    os.makedirs(args.out, exist_ok=True)
+    simnum = next_simnum(args.out)
+    for i in range(len(eff)):
+        path = os.path.join(args.out, f"{simnum + i}.csv")
+        write_order(path, simnum + i, types[i], fix_cue[i], fix_stim[i], fix_feedback[i])
+        print(f"{path}: efficiency {eff[i]:.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+quest.py
+
+A QUEST-style Bayesian adaptive procedure for the target duration, as an
+alternative to StairHandler.
+
+The posterior over the participant's threshold (the target duration, in
+frames, at which they hit `target` of the time) is kept on a grid as log
+probabilities. Each response adds that outcome's log likelihood at the
+duration shown, one vectorized add, and the next duration is the posterior
+mean rounded to a whole frame. The likelihoods for every duration that can
+be shown are worked out once up front.
+
+QuestStaircase has the parts of StairHandler's interface mid.py uses:
+next(), addResponse(), thisTrialN, data and intensities.
+"""
+import math
+
+import numpy as np
+
+target_hit_rate = 2 / 3
+
+
+def normal_cdf(x):
+    return 0.5 * (1 + np.vectorize(math.erf)(np.asarray(x) / math.sqrt(2)))
+
+
+def normal_ppf(p):
+    # inverse of normal_cdf by bisection; only needed once
+    lo, hi = -10.0, 10.0
+    for _ in range(100):
+        mid = (lo + hi) / 2
+        if normal_cdf(mid) < p:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+class QuestStaircase:
+    """
+    startVal, minVal and maxVal are durations in frames as for StairHandler.
+    `prior_sd` is how far (in frames) the threshold may be from startVal,
+    `slope` the spread of the psychometric function in frames (roughly the
+    RT sd), and `lapse` the chance of missing a target that's easily long
+    enough.
+    """
+
+    def __init__(self, startVal=15, nTrials=None, minVal=0, maxVal=30, target=target_hit_rate,
+                 prior_sd=6.0, slope=3.0, lapse=0.02, grid_step=0.1):
+        self.startVal = startVal
+        self.nTrials = nTrials
+        self.minVal = minVal
+        self.maxVal = maxVal
+        self.prior_sd = prior_sd
+        # thresholds can be past either end of what we can show
+        self.grid = np.arange(minVal - 2 * prior_sd, maxVal + 2 * prior_sd + grid_step / 2, grid_step)
+        durations = np.arange(minVal, maxVal + 1)
+        # at the threshold, hits come `target` of the time
+        z = normal_ppf(target / (1 - lapse))
+        p_hit = (1 - lapse) * normal_cdf((durations[:, None] - self.grid) / slope + z)
+        p_hit = np.clip(p_hit, 1e-6, 1 - 1e-6)
+        self.log_likelihood = {1: np.log(p_hit), 0: np.log(1 - p_hit)}
+        self.reset()
+
+    def reset(self):
+        self.thisTrialN = -1
+        self.data = []
+        self.intensities = []
+        self.log_posterior = -0.5 * ((self.grid - self.startVal) / self.prior_sd) ** 2
+
+    def posterior(self):
+        p = np.exp(self.log_posterior - self.log_posterior.max())
+        return p / p.sum()
+
+    def summary(self):
+        """Posterior mean, sd and mode of the threshold, in frames"""
+        p = self.posterior()
+        mean = float(p @ self.grid)
+        sd = float(np.sqrt(p @ (self.grid - mean) ** 2))
+        return {'mean': mean, 'sd': sd, 'mode': float(self.grid[p.argmax()])}
+
+    def next(self):
+        p = self.posterior()
+        duration = int(round(float(p @ self.grid)))
+        duration = min(max(duration, self.minVal), self.maxVal)
+        self.thisTrialN += 1
+        self.intensities.append(duration)
+        return duration
+
+    __next__ = next
+
+    def addResponse(self, result):
+        self.data.append(result)
+        self.log_posterior = self.log_posterior + self.log_likelihood[int(bool(result))][
+            self.intensities[-1] - self.minVal]
+
+    def get_state(self):
+        # the posterior follows from the responses, so they're all we keep
+        return {'thisTrialN': self.thisTrialN, 'data': list(self.data), 'intensities': list(self.intensities)}
+
+    def set_state(self, state):
+        self.reset()
+        for duration, result in zip(state['intensities'], state['data']):
+            self.intensities.append(duration)
+            self.addResponse(result)
+        # a duration shown but not yet answered
+        self.intensities = list(state['intensities'])
+        self.thisTrialN = state['thisTrialN']
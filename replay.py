@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+replay.py
+
+Replays a recorded session through mid.py's scoring and checks that it
+comes out the same.
+
+The random generator is seeded from the participant and session numbers
+as mid.py seeds it, and each trial's recorded key events (a press during
+the cue or the fixation before the target, and the RT of the first press
+in the target's response window, hit or not) are fed back through
+scoring.py: the same staircases, the same window and too-fast rules, the
+same reward draws and nudging toward the session's recorded earnings goal,
+with no window and no waiting. Every trial's staircase value, response, reward and running
+total is compared with what was recorded. Sessions resumed from a
+checkpoint carry on from the state in their checkpoint file, as mid.py did.
+
+    python replay.py data/MID1.0_fmri_0012.csv
+    python replay.py --batch data
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import scoring
+from bidsevents import number
+from checkpoint import checkpoint_path
+from datafiles import find_sessions, iter_rows
+from orderbank import load_order
+from quest import QuestStaircase
+from stairstate import set_state
+
+orders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'orders')
+
+checked = ['trial.type', 'trial.staircase.durationFrames', 'trial.response', 'trial.reward', 'total_earnings']
+
+
+def yes(row, field):
+    return str(row.get(field, 'no')).lower() == 'yes'
+
+
+def session_runs(path):
+    """The first row of a session file, and each run's (order reference, trial rows)"""
+    first = None
+    runs = []
+    for row in iter_rows(path):
+        if first is None:
+            first = row
+        if row.get('run.order.file') not in (None, ''):
+            runs.append((str(row['run.order.file']), []))
+        elif number(row, 'trial.number') is not None:
+            runs[-1][1].append(row)
+    return first, [r for r in runs if r[1]]
+
+
+def resumed_from(path, first, trial_number):
+    """The checkpoint the session was resumed from, or None"""
+    fmri = yes(first, 'fMRI? (yes or no)')
+    checkpoint = checkpoint_path(os.path.dirname(path), first.get('expName', 'MID1.0'), fmri,
+                                 int(number(first, 'participant')), int(number(first, 'session')))
+    state = None
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            for line in f:
+                try:
+                    s = json.loads(line)
+                except ValueError:
+                    continue
+                if s['trial_number'] == trial_number:
+                    state = s
+    return state
+
+
+def read_order(ref):
+    if '#' not in ref and not os.path.exists(ref):
+        # recorded on another machine
+        ref = os.path.join(orders_dir, os.path.basename(ref.replace('\\', '/')))
+    return load_order(ref)
+
+
+def key_response(row):
+    """Whether the trial was a hit, from its recorded key events"""
+    if 'trial.target.press_rt' in row:
+        rt = number(row, 'trial.target.press_rt')
+    else:
+        # recorded before every press was saved: only hits have an RT
+        rt = number(row, 'trial.rt')
+    window = number(row, 'trial.target.measured_duration')
+    if window is None:
+        window = number(row, 'trial.staircase_stim_duration')
+    hit = int(rt is not None and rt < window)
+    if scoring.too_fast(hit, number(row, 'trial.cue_rt'), number(row, 'trial.too_fast_rt')):
+        hit = 0
+    return hit
+
+
+def replay_session(path, goal=None):
+    """
+    Replay one session file. Returns a dict with the number of trials
+    replayed and a list of (trial number, column, recorded, replayed) for
+    every value that came out different, or an 'error' if it can't be
+    replayed. `goal` is only used for sessions that didn't record theirs.
+    """
+    result = {'path': path, 'trials': 0, 'mismatches': [], 'error': None}
+    first, runs = session_runs(path)
+    if not runs:
+        result['error'] = 'no trials'
+        return result
+    try:
+        orders = [read_order(ref) for ref, _ in runs]
+    except OSError as e:
+        result['error'] = f"can't read its order file, {e}"
+        return result
+    if number(first, 'total_earnings_goal') is not None:
+        goal = number(first, 'total_earnings_goal')
+    elif goal is None:
+        goal = scoring.total_earnings_goal
+
+    participant = int(number(first, 'participant'))
+    session = int(number(first, 'session'))
+    single = yes(first, 'do only a single behavioral practice run?')
+    start_run = int(number(first, 'start run (0-3)') or 0)
+    n_runs = 1 if single else scoring.num_runs
+    ranges = scoring.reward_ranges(yes(first, 'use ranged rewards?'))
+    nudge = yes(first, 'use nudge for final run?')
+    quest = {str(row['trial.type']) for _, rows in runs for row in rows
+             if number(row, 'trial.quest.mean') is not None}
+
+    rng = random.Random(participant * (session + 1000))
+    if '#' not in runs[0][0]:
+        # mid.py picks orders whether or not it then resumes; only how many
+        # there were to pick from matters to the generator
+        scoring.pick_orders(scoring.order_files(orders_dir), rng)
+
+    stairs = {}
+    for t, n in scoring.trials_per_type(n_runs, orders[0]).items():
+        start_val = int(number(first, 'staircase start ' + t) or 15)
+        if t in quest:
+            stairs[t] = QuestStaircase(startVal=start_val, nTrials=n, minVal=scoring.min_val, maxVal=scoring.max_val)
+        else:
+            stairs[t] = scoring.make_staircase(n, start_val, start_run)
+
+    total = 0
+    first_trial = 0
+    trial_number = int(number(runs[0][1][0], 'trial.number'))
+    if trial_number > 1 and yes(first, 'resume from checkpoint? (yes or no)'):
+        state = resumed_from(path, first, trial_number - 1)
+        if state is None:
+            result['error'] = f"resumed at trial number {trial_number}, but there's no checkpoint for it"
+            return result
+        for t, s in state['stairs'].items():
+            set_state(stairs[t], s)
+        rng.setstate((state['random'][0], tuple(state['random'][1]), state['random'][2]))
+        total = state['total_earnings']
+        first_trial = state['trial']
+        if first_trial >= scoring.num_trials:
+            total = scoring.total_after_run(state['run'], total, single)
+            first_trial = 0
+
+    for k, (order, (_, rows)) in enumerate(zip(orders, runs)):
+        run = int(number(rows[0], 'run'))
+        run_first_trial = first_trial if k == 0 else 0
+        controller = None
+        if scoring.should_nudge(nudge, run, n_runs):
+            controller = scoring.earnings_controller(
+                [t['trial.type'] for t in order[run_first_trial:]], ranges, stairs, goal, total)
+
+        for trial, row in enumerate(rows, run_first_trial):
+            trial_type = order[trial]['trial.type']
+            stair = stairs[trial_type]
+            frames = stair.next()
+            response = key_response(row)
+            stair.addResponse(response)
+            reward = scoring.trial_reward(trial_type, response, ranges, rng, controller,
+                                          trial - run_first_trial, total)
+            total += reward
+
+            replayed = [trial_type, frames, response, reward, total]
+            for name, value in zip(checked, replayed):
+                recorded = row.get(name)
+                same = str(recorded) == value if name == 'trial.type' else number(row, name) == value
+                if not same:
+                    result['mismatches'].append((int(number(row, 'trial.number')), name, recorded, value))
+            result['trials'] += 1
+        total = scoring.total_after_run(run, total, single)
+    return result
+
+
+def describe(result):
+    if result['error']:
+        return f"{result['path']}: can't replay, {result['error']}"
+    if not result['mismatches']:
+        return f"{result['path']}: ok, {result['trials']} trials"
+    trial, name, recorded, replayed = result['mismatches'][0]
+    return (f"{result['path']}: {len(result['mismatches'])} differences over {result['trials']} trials, "
+            f"first at trial {trial}: {name} recorded {recorded}, replayed {replayed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('paths', nargs='*', help='session files, or with --batch, directories')
+    parser.add_argument('--batch', action='store_true', help='replay every session under the given directories (data/ by default)')
+    parser.add_argument('--goal', type=int, default=None,
+                        help="for sessions that didn't record their earnings goal")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.batch:
+        paths = [p for d in (args.paths or ['data']) for p in find_sessions(d)]
+    else:
+        paths = args.paths
+    if not paths:
+        parser.error("no session files to replay")
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(replay_session, paths, [args.goal] * len(paths)))
+    for r in results:
+        print(describe(r))
+
+    failed = [r for r in results if r['error'] or r['mismatches']]
+    print(f"\n{len(results) - len(failed)} of {len(results)} sessions replay exactly")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
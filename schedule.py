@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+schedule.py
+
+Planned event onsets for a run of mid.py.
+
+An order file lists each trial's fixation jitters; together with the fixed
+cue, target and feedback durations those set when every event should
+happen. Onsets here are seconds on the run clock, starting from the end of
+the run's initial fixation, so at full speed they're the order file's
+`ons.cue`/`ons.stim`/`ons.feedback` shifted so the first cue lands right
+after the initial fixation.
+"""
+
+
+def planned_onsets(order, initial_fix, cue_time, max_target_dur, feedback_time, speed=1.0):
+    """
+    Planned run-clock onsets for every trial in `order`.
+
+    `speed` multiplies the fixations, as speed_up does for the practice run.
+    Returns one dict per trial with 'cue', 'target' and 'feedback' onsets,
+    and 'end' for when the trial's final fixation should finish.
+    """
+    plan = []
+    t = float(initial_fix)
+    for trial in order:
+        cue = t
+        target = cue + cue_time + float(trial['fix.after.cue']) * speed
+        feedback = target + max_target_dur + float(trial['fix.after.stim']) * speed
+        t = feedback + feedback_time + float(trial['fix.after.feedback']) * speed
+        plan.append({'cue': cue, 'target': target, 'feedback': feedback, 'end': t})
+    return plan
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+scoring.py
+
+The rules that decide what a participant is paid in mid.py, with no
+PsychoPy in them: the staircases that set each target's duration, the
+choice of trial orders, which trials pay, how much, nudging on the final
+run and when the total is reset. The session's layout and timing are
+here too, so the scripts that read or model mid.py's data share its values
+rather than copying them.
+
+mid.py calls these at each of those points, and session_sim.py runs the
+same functions for synthetic observers, so a simulated session is scored
+and paid exactly like a real one given the same responses. Anything random
+is drawn from the `rng` passed in (mid.py passes the `random` module after
+seeding it), one draw at a time in the order mid.py makes them.
+"""
+from pathlib import Path
+
+from earnings import EarningsController, hit_rate
+
+trial_types = ['loss.high', 'loss.low', 'neutral', 'reward.high', 'reward.low']
+
+# Four runs, first is the practice/calibration one
+num_runs = 4
+# Trials per run; changing it means regenerating the order files
+num_trials = 30
+total_earnings_goal = 40
+
+# seconds; fixation lengths come from the order files
+initial_fix_duration = 8  # before each run's first trial, for the magnetic field to settle
+cue_time = 2.0
+feedback_time = 2.0
+single_speed_factor = 0.25  # fixations are multiplied by this in the practice run
+frame_duration = 1.0 / 60.0  # when the frame rate isn't measured
+
+# staircase step sizes, in frames, by reversal count
+step_schedules = {
+    'calibration': [6, 3, 3, 2, 2, 1, 1],  # start run 0
+    'resume':      [2, 2, 1, 1],           # later start runs
+}
+min_val = 0
+max_val = 30
+n_up = 1
+n_down = 2  # will home in on the 66% threshold (nUp=1, nDown=3 homes in on 80%)
+
+min_target_dur = 0.1
+max_target_dur = 0.5
+
+# (lowest, highest) amount for each trial type that pays
+ranged_rewards = {
+    'reward.high': (5, 7),
+    'reward.low':  (1, 3),
+    'loss.high':   (-7, -5),
+    'loss.low':    (-3, -1),
+}
+fixed_rewards = {
+    'reward.high': (7, 7),
+    'reward.low':  (1, 1),
+    'loss.high':   (-7, -7),
+    'loss.low':    (-1, -1),
+}
+
+
+class Staircase:
+    """
+    A linear-step 1-up/2-down staircase that moves exactly like PsychoPy's
+    `data.StairHandler(stepType='lin', ...)`: 1-up/1-down until the first
+    reversal, then nUp/nDown, with the step size taken from `stepSizes` by
+    reversal count and the value clamped to [minVal, maxVal]. Its attributes
+    have StairHandler's names, so stairstate saves and restores it the same
+    way.
+    """
+
+    def __init__(self, startVal, stepSizes, nTrials, minVal=min_val, maxVal=max_val,
+                 nUp=n_up, nDown=n_down, extraInfo=None):
+        self.startVal = startVal
+        self.stepSizes = list(stepSizes)
+        self.nTrials = nTrials
+        self.nReversals = len(self.stepSizes)
+        self.minVal = minVal
+        self.maxVal = maxVal
+        self.nUp = nUp
+        self.nDown = nDown
+        self.extraInfo = extraInfo
+        self.applyInitialRule = True
+        self._variableStep = len(self.stepSizes) > 1
+        self.stepSizeCurrent = self.stepSizes[0]
+
+        self.thisTrialN = -1
+        self.data = []
+        self.intensities = []
+        self.reversalPoints = []
+        self.reversalIntensities = []
+        self.currentDirection = 'start'
+        self.correctCounter = 0
+        self.initialRule = False
+        self.finished = False
+        self._nextIntensity = startVal
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+        self.thisTrialN += 1
+        self.intensities.append(self._nextIntensity)
+        return self._nextIntensity
+
+    next = __next__
+
+    def addResponse(self, result):
+        self.data.append(result)
+        run = len(self.data) > 1 and self.data[-2] == result
+        if result == 1:
+            self.correctCounter = self.correctCounter + 1 if run else 1
+        else:
+            self.correctCounter = self.correctCounter - 1 if run else -1
+        self.calculateNextIntensity()
+
+    def calculateNextIntensity(self):
+        initial = not self.reversalIntensities and self.applyInitialRule
+        if initial:
+            # always 1-up/1-down until the first reversal
+            direction = 'down' if self.data[-1] == 1 else 'up'
+            reversal = self.currentDirection == ('up' if direction == 'down' else 'down')
+            self.currentDirection = direction
+        elif self.correctCounter >= self.nDown:
+            reversal = self.currentDirection not in ('start', 'down')
+            self.currentDirection = 'down'
+        elif self.correctCounter <= -self.nUp:
+            reversal = self.currentDirection not in ('start', 'up')
+            self.currentDirection = 'up'
+        else:
+            reversal = False
+
+        if reversal:
+            self.reversalPoints.append(self.thisTrialN)
+            if initial:
+                self.initialRule = True
+            self.reversalIntensities.append(self.intensities[-1])
+
+        if len(self.reversalIntensities) >= self.nReversals and len(self.intensities) >= self.nTrials:
+            self.finished = True
+
+        if reversal and self._variableStep:
+            n = len(self.reversalIntensities)
+            self.stepSizeCurrent = self.stepSizes[min(n, len(self.stepSizes) - 1)]
+
+        if (not self.reversalIntensities or self.initialRule) and self.applyInitialRule:
+            self.initialRule = False
+            self._step(-1 if self.data[-1] == 1 else 1)
+        elif self.correctCounter >= self.nDown:
+            self._step(-1)
+        elif self.correctCounter <= -self.nUp:
+            self._step(1)
+
+    def _step(self, direction):
+        value = self._nextIntensity + direction * self.stepSizeCurrent
+        if self.minVal is not None and value < self.minVal:
+            value = self.minVal
+        if self.maxVal is not None and value > self.maxVal:
+            value = self.maxVal
+        self._nextIntensity = value
+        self.correctCounter = 0
+
+
+def step_sizes(start_run):
+    """Big steps to calibrate from the practice run, small ones after that"""
+    return step_schedules['calibration' if start_run == 0 else 'resume']
+
+
+def make_staircase(n_trials, start_val=15.0, start_run=0, extra_info=None):
+    return Staircase(startVal=start_val, stepSizes=step_sizes(start_run), nTrials=n_trials,
+                     extraInfo=extra_info)
+
+
+def trials_per_type(num_runs, order):
+    """
+    Trials of each type over a session of `num_runs` runs, from one of its
+    orders; every order in `orders/` (or a bank) has the same mix of types
+    """
+    counts = dict.fromkeys(trial_types, 0)
+    for trial in order:
+        counts[trial['trial.type']] += 1
+    return {t: num_runs * n for t, n in counts.items()}
+
+
+def order_files(orders_dir):
+    """The order CSVs to pick from, in the order the file system lists them"""
+    return list(Path(orders_dir).glob("*.csv"))
+
+
+def pick_orders(orders, rng, n=4):
+    """Trial orders for a session's runs, without replacement"""
+    return rng.sample(orders, n)
+
+
+def reward_ranges(ranged):
+    return dict(ranged_rewards if ranged else fixed_rewards)
+
+
+def too_fast(hit, cue_rt, too_fast_rt):
+    """A hit doesn't count if a button went down during the cue or fixation before the target"""
+    return bool(hit) and bool(cue_rt or too_fast_rt)
+
+
+def pays(trial_type, hit):
+    """Rewards are paid for hits, losses are taken for misses, neutral trials never pay"""
+    if trial_type.startswith('reward'):
+        return bool(hit)
+    if trial_type.startswith('loss'):
+        return not hit
+    return False
+
+
+def should_nudge(nudge_final_run, run, num_runs):
+    # we optionally nudge on the last run (-1 when counting from 0)
+    return nudge_final_run and run == num_runs - 1
+
+
+def earnings_controller(run_types, ranges, stairs, goal, total):
+    """Lookahead controller for the rest of a nudged run, from the staircases' hit rates so far"""
+    return EarningsController(run_types, ranges, {t: hit_rate(s) for t, s in stairs.items()},
+                              goal, total)
+
+
+def trial_reward(trial_type, hit, ranges, rng, controller=None, k=None, total=None):
+    """
+    What a trial pays. Without a controller the amount is drawn from the
+    trial type's range; with one, it's the controller's pick for trial `k`
+    of the run given `total` earned so far.
+    """
+    if not pays(trial_type, hit):
+        return 0
+    if controller is None:
+        low, high = ranges[trial_type]
+        return rng.choice(list(range(low, high + 1)))
+    return controller.reward(k, total)
+
+
+def total_after_run(run, total, single=False):
+    """Earnings carried into the next run; the practice run's are dropped"""
+    return 0 if run == 0 and not single else total
+
+
+def stim_duration(frames, frame_duration, min_duration=min_target_dur):
+    """Target duration in seconds for a staircase value in frames"""
+    return min_duration + frame_duration * frames
+
+
+def target_flips(duration, frame_duration, max_duration=max_target_dur):
+    """
+    Flips the target is up for when frame counted; it always comes down
+    inside the response window so the keys get checked.
+    """
+    routine_flips = int(round(max_duration / frame_duration))
+    return min(int(round(duration / frame_duration)), routine_flips - 1)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+session_sim.py
+
+Whole sessions of mid.py, scored by the same code, for synthetic observers.
+
+Each session goes through scoring.py exactly as mid.py does: the random
+generator is seeded from the participant and session numbers, orders are
+picked from `orders/`, the staircases set every target's duration in
+counted flips, a press only counts while the target is up and not after a
+press during the cue or fixation, and rewards are drawn (or nudged on the
+final run) and totalled with the practice run's earnings dropped. So the
+earnings here are what a participant who responds like the observer would
+be paid, down to the amounts drawn.
+
+Observers respond with normally distributed RTs around their own mean and
+spread, and press early on a fraction of trials. Sessions are split into
+chunks and run over a process pool.
+
+    python session_sim.py -n 20000 --ranged --nudge
+"""
+import argparse
+import os
+import random
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import scoring
+from orderbank import read_order_csv
+from scoring import frame_duration, num_runs, num_trials, total_earnings_goal
+
+orders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'orders')
+
+chunk_size = 500
+quantiles = [5, 25, 50, 75, 95]
+
+# order CSVs, read once per worker process
+_orders = {}
+
+
+def read_order(path):
+    if path not in _orders:
+        _orders[path] = read_order_csv(path)
+    return _orders[path]
+
+
+def make_observers(n, rng, rt_mean=0.25, rt_mean_sd=0.03, rt_sd=0.04, rt_sd_sd=0.01, early=0.02):
+    """
+    Draw `n` synthetic observers, each with their own RT mean and spread in
+    seconds and chance of pressing early. Returns a dict of arrays.
+    """
+    return {
+        'rt_mean': rng.normal(rt_mean, rt_mean_sd, n),
+        'rt_sd': np.clip(rng.normal(rt_sd, rt_sd_sd, n), 0.005, None),
+        'early': np.full(n, float(early)),
+    }
+
+
+def simulate_session(participant, session, observer, orders, ranged=False, nudge=False,
+                     goal=total_earnings_goal, start_val=15, seed=None):
+    """
+    One session for one observer (a dict of its RT mean, RT sd and early
+    press rate). `orders` is the list of order CSVs mid.py would pick from.
+    `seed` only seeds the observer's responses (a fresh one is drawn if
+    it's None); everything mid.py draws comes from the participant and
+    session numbers, as it does there.
+    """
+    if seed is None:
+        seed = secrets.randbits(32)
+    rng = random.Random(participant * (session + 1000))
+    responses = np.random.default_rng([seed, participant, session])
+    n = num_runs * num_trials
+    # plain lists are quicker than arrays to read one item at a time
+    rts = (observer['rt_mean'] + observer['rt_sd'] * responses.standard_normal(n)).tolist()
+    early = (responses.random(n) < observer['early']).tolist()
+
+    order_files = scoring.pick_orders(orders, rng)
+    ranges = scoring.reward_ranges(ranged)
+    stairs = {t: scoring.make_staircase(k, start_val) for t, k in
+              scoring.trials_per_type(num_runs, read_order(str(order_files[0]))).items()}
+
+    total = 0
+    paid = 0
+    i = 0
+    for run in range(num_runs):
+        order = read_order(str(order_files[run]))
+        controller = None
+        if scoring.should_nudge(nudge, run, num_runs):
+            controller = scoring.earnings_controller(
+                [t['trial.type'] for t in order], ranges, stairs, goal, total)
+        for trial in range(num_trials):
+            trial_type = order[trial]['trial.type']
+            stair = stairs[trial_type]
+            frames = stair.next()
+            duration = scoring.stim_duration(frames, frame_duration)
+            up = scoring.target_flips(duration, frame_duration) * frame_duration
+            hit = int(0 <= rts[i] < up)
+            if scoring.too_fast(hit, early[i], None):
+                hit = 0
+            stair.addResponse(hit)
+            total += scoring.trial_reward(trial_type, hit, ranges, rng, controller, trial, total)
+            i += 1
+        paid = total
+        total = scoring.total_after_run(run, total)
+
+    return {
+        'seed': seed,
+        'total_earnings': paid,
+        'hit_rate': {t: float(np.mean(s.data)) for t, s in stairs.items()},
+        'staircase_end': {t: s.intensities[-1] for t, s in stairs.items()},
+    }
+
+
+def _simulate_chunk(participants, session, observers, orders, ranged, nudge, goal, seed):
+    results = []
+    for j, participant in enumerate(participants):
+        observer = {k: v[j] for k, v in observers.items()}
+        results.append(simulate_session(participant, session, observer, orders,
+                                        ranged, nudge, goal, seed=seed))
+    return results
+
+
+def simulate_sessions(n, ranged=False, nudge=False, goal=total_earnings_goal, session=1,
+                      first_participant=1, seed=None, workers=None, **observer_args):
+    """
+    Simulate `n` sessions, one per participant number from
+    `first_participant`, each with its own observer. Returns a list of the
+    dicts simulate_session gives, in participant order. With no `seed` one
+    is drawn, and recorded in every result so the run can be repeated.
+    """
+    if seed is None:
+        seed = secrets.randbits(32)
+    observers = make_observers(n, np.random.default_rng(seed), **observer_args)
+    orders = scoring.order_files(orders_dir)
+    participants = list(range(first_participant, first_participant + n))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_simulate_chunk, participants[start:start + chunk_size], session,
+                        {k: v[start:start + chunk_size] for k, v in observers.items()},
+                        orders, ranged, nudge, goal, seed)
+            for start in range(0, n, chunk_size)
+        ]
+        return [r for f in futures for r in f.result()]
+
+
+def summarize(results, goal=total_earnings_goal):
+    totals = np.array([r['total_earnings'] for r in results], dtype=float)
+    summary = {
+        'seed': results[0]['seed'] if results else None,
+        'sessions': len(results),
+        'mean': totals.mean(),
+        'sd': totals.std(),
+        'within_5': np.mean(np.abs(totals - goal) <= 5),
+    }
+    summary.update({f'q{q}': v for q, v in zip(quantiles, np.percentile(totals, quantiles))})
+    for t in scoring.trial_types:
+        summary[f'hit_rate.{t}'] = np.mean([r['hit_rate'][t] for r in results])
+        summary[f'staircase_end.{t}'] = np.mean([r['staircase_end'][t] for r in results])
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('-n', '--sessions', type=int, default=10000)
+    parser.add_argument('--ranged', action='store_true', help='use ranged rewards')
+    parser.add_argument('--nudge', action='store_true', help='nudge the final run toward the goal')
+    parser.add_argument('--goal', type=int, default=total_earnings_goal)
+    parser.add_argument('--session', type=int, default=1)
+    parser.add_argument('--rt-mean', type=float, default=0.25, help='population RT mean in seconds')
+    parser.add_argument('--rt-sd', type=float, default=0.04, help='typical RT sd within an observer')
+    parser.add_argument('--early', type=float, default=0.02, help='chance of an early press on a trial')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    results = simulate_sessions(args.sessions, args.ranged, args.nudge, args.goal, args.session,
+                                seed=args.seed, workers=args.workers,
+                                rt_mean=args.rt_mean, rt_sd=args.rt_sd, early=args.early)
+    s = summarize(results, args.goal)
+
+    print(f"{s['sessions']} sessions, {'ranged' if args.ranged else 'fixed'} rewards, "
+          f"{'nudged' if args.nudge else 'no nudge'}, goal {args.goal}, seed {s['seed']}")
+    print(f"total earnings: mean {s['mean']:.2f}  sd {s['sd']:.2f}  "
+          f"within 5 of goal {s['within_5'] * 100:.1f}%")
+    print('  ' + '  '.join(f"q{q} {s[f'q{q}']:.0f}" for q in quantiles))
+    print(f"\n{'trial type':<13}{'hit rate':>9}{'staircase end':>15}")
+    for t in scoring.trial_types:
+        print(f"{t:<13}{s[f'hit_rate.{t}']:>9.3f}{s[f'staircase_end.{t}']:>15.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+sessiondb.py
+
+A small SQLite database of finished sessions, so staircase start values
+don't have to be dug out of old log files.
+
+When mid.py shuts down it adds a row for the session: participant, session,
+total earnings, the staircase end values (the numbers the log lists as
+"Staircase end value for ...") and the full staircase states. At startup
+the latest row for the participant fills in the staircase start fields of
+the setup dialog.
+
+    python sessiondb.py --participant 12
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+default_path = os.path.join('data', 'sessions.db')
+
+schema = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    participant INTEGER NOT NULL,
+    session INTEGER NOT NULL,
+    fmri INTEGER NOT NULL,
+    finished TEXT NOT NULL,
+    trials INTEGER NOT NULL,
+    total_earnings REAL NOT NULL,
+    staircase_end TEXT NOT NULL,    -- JSON, trial type: duration in frames
+    staircase_state TEXT NOT NULL   -- JSON, trial type: stairstate.get_state()
+);
+CREATE INDEX IF NOT EXISTS sessions_by_participant ON sessions (participant, id);
+"""
+
+
+def connect(path=default_path):
+    conn = sqlite3.connect(path)
+    conn.executescript(schema)
+    return conn
+
+
+def record_session(path, participant, session, fmri, trials, total_earnings,
+                   staircase_end, staircase_state):
+    with connect(path) as conn:
+        conn.execute(
+            "INSERT INTO sessions (participant, session, fmri, finished, trials, total_earnings,"
+            " staircase_end, staircase_state) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (participant, session, int(fmri), time.strftime('%Y-%m-%d %H:%M:%S'), trials,
+             total_earnings, json.dumps(staircase_end), json.dumps(staircase_state)))
+    conn.close()
+
+
+def latest_staircase_end(path, participant):
+    """Staircase end values from the participant's latest session, or None"""
+    if not os.path.exists(path):
+        return None
+    conn = connect(path)
+    row = conn.execute(
+        "SELECT staircase_end FROM sessions WHERE participant = ? ORDER BY id DESC LIMIT 1",
+        (participant,)).fetchone()
+    conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--participant', type=int, required=True)
+    parser.add_argument('--db', default=default_path)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} doesn't exist yet")
+    conn = connect(args.db)
+    rows = conn.execute(
+        "SELECT session, fmri, finished, trials, total_earnings, staircase_end FROM sessions"
+        " WHERE participant = ? ORDER BY id", (args.participant,)).fetchall()
+    conn.close()
+    for session, fmri, finished, trials, earnings, end in rows:
+        end = ', '.join(f"{k} {v}" for k, v in sorted(json.loads(end).items()))
+        print(f"session {session} ({['behavioral', 'fmri'][fmri]}) finished {finished}: "
+              f"{trials} trials, earned {earnings:g}; staircase end {end}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+simulator.py
+
+Vectorized Monte Carlo version of `simulate_task` from Simulator.ipynb.
+
+Instead of simulating one session at a time, every session is a row in a set
+of NumPy arrays: a shuffled trial matrix, a Bernoulli hit matrix and a matrix
+of reward draws. Runs without nudging are summed in one shot; runs with
+nudging are stepped through trial by trial, but each step updates every
+session at once.
+
+    from simulator import simulate_sessions
+    totals = simulate_sessions(0.66, range_rewards_1, 40, nudge_run=3, n=10**6)
+"""
+import numpy as np
+
+num_runs = 3
+# Trials per run
+num_trials = 30
+
+trial_types = ['neutral', 'reward.high', 'reward.low', 'loss.high', 'loss.low']
+
+# 10 neutral, 5 of each of the others, same as `possible_trials` in the notebook
+trial_counts = {
+    'neutral':     10,
+    'reward.high':  5,
+    'reward.low':   5,
+    'loss.high':    5,
+    'loss.low':     5,
+}
+
+possible_trials = np.repeat(
+    np.arange(len(trial_types), dtype=np.int8),
+    [trial_counts[t] for t in trial_types])
+
+# Reward tables from the notebook; "stable" is what mid.py uses without
+# ranged rewards
+reward_presets = {
+    'stable': {
+        'reward.high': (7, 7),
+        'reward.low': (1, 1),
+        'loss.high': (-7, -7),
+        'loss.low': (-1, -1),
+    },
+    'stable_narrow': {
+        'reward.high': (6, 6),
+        'reward.low': (2, 2),
+        'loss.high': (-6, -6),
+        'loss.low': (-2, -2),
+    },
+    'range_1': {
+        'reward.high': (3, 7),
+        'reward.low': (1, 3),
+        'loss.high': (-7, -3),
+        'loss.low': (-3, -1),
+    },
+    'range_2': {
+        'reward.high': (4, 7),
+        'reward.low': (1, 4),
+        'loss.high': (-7, -4),
+        'loss.low': (-4, -1),
+    },
+    'range_3': {
+        'reward.high': (3, 7),
+        'reward.low': (1, 5),
+        'loss.high': (-7, -3),
+        'loss.low': (-5, -1),
+    },
+    'range_zero': {
+        'reward.high': (4, 7),
+        'reward.low': (0, 2),
+        'loss.high': (-7, -4),
+        'loss.low': (-2, 0),
+    },
+}
+
+# Sessions are simulated in blocks so memory stays bounded for huge n
+chunk_size = 2 ** 17
+
+
+def reward_tables(rewards):
+    """
+    Turn a reward dictionary like `range_rewards_1` into per-type lookup
+    arrays (indexed like `trial_types`) for the low and high end of each
+    range, plus which types pay on a hit and which cost on a miss.
+    """
+    lo = np.zeros(len(trial_types), dtype=np.int64)
+    hi = np.zeros(len(trial_types), dtype=np.int64)
+    for i, t in enumerate(trial_types):
+        if t in rewards:
+            lo[i], hi[i] = rewards[t]
+    gain = np.array([t.startswith('reward') for t in trial_types])
+    loss = np.array([t.startswith('loss') for t in trial_types])
+    return lo, hi, gain, loss
+
+
+def _simulate_chunk(rng, n, success_rate, tables, total_earnings_goal, nudge_run):
+    lo, hi, gain, loss = tables
+    total = np.zeros(n, dtype=np.int64)
+    for run in range(1, num_runs + 1):
+        nudge_rewards = run >= nudge_run
+
+        if nudge_rewards:
+            # order matters for the nudge, so shuffle each session's run
+            trials = rng.permuted(np.tile(possible_trials, (n, 1)), axis=1)
+        else:
+            # without nudging the run total doesn't depend on trial order
+            trials = np.broadcast_to(possible_trials, (n, num_trials))
+
+        # fake a participant response at our specified rate
+        trial_response = rng.random((n, num_trials)) < success_rate
+        rewarded = (gain[trials] & trial_response) | (loss[trials] & ~trial_response)
+
+        trial_lo = lo[trials]
+        trial_hi = hi[trials]
+
+        if not nudge_rewards:
+            # uniform pick from each range, inclusive of both ends
+            span = trial_hi - trial_lo + 1
+            draws = trial_lo + (rng.random((n, num_trials)) * span).astype(np.int64)
+            total += np.where(rewarded, draws, 0).sum(axis=1)
+        else:
+            # step through the run, picking whichever end of the range
+            # lands closer to the goal for every session at once
+            for j in range(num_trials):
+                d0 = np.abs(total + trial_lo[:, j] - total_earnings_goal)
+                d1 = np.abs(total + trial_hi[:, j] - total_earnings_goal)
+                nudged = np.where(d0 < d1, trial_lo[:, j], trial_hi[:, j])
+                total += np.where(rewarded[:, j], nudged, 0)
+    return total
+
+
+def simulate_sessions(success_rate, rewards, total_earnings_goal, nudge_run=4, n=100000, seed=None):
+    """
+    Simulate `n` sessions and return an array of their total earnings.
+
+    Arguments match the notebook's `simulate_task`; `nudge_run` counts runs
+    from 1, so the default of 4 never nudges.
+    """
+    rng = np.random.default_rng(seed)
+    tables = reward_tables(rewards)
+    totals = np.empty(n, dtype=np.int64)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        totals[start:stop] = _simulate_chunk(
+            rng, stop - start, success_rate, tables, total_earnings_goal, nudge_run)
+    return totals
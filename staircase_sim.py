@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+staircase_sim.py
+
+Checks whether the staircase settings in `make_stairs` (mid.py) converge on
+the target hit rate within the trials we give them, by running the same
+1-up/2-down rules against thousands of synthetic observers at once.
+
+Each staircase is a row in a set of NumPy arrays, so a whole population is
+stepped forward with one set of array operations per trial instead of one
+`data.StairHandler` per observer. The update rules follow StairHandler:
+1-up/1-down until the first reversal, then nUp/nDown, with the step size
+taken from `stepSizes` by reversal count.
+
+Observers respond with normally distributed RTs and hit when the RT is
+shorter than the target duration, so the hit probability at a given
+duration follows from each observer's RT mean and spread.
+
+Run `python staircase_sim.py` for a summary table, or import
+`simulate_conditions` for the raw per-observer results.
+"""
+import argparse
+from statistics import NormalDist
+
+import numpy as np
+
+from scoring import (frame_duration, max_val, min_target_dur, min_val, n_down, n_up,
+                     num_trials, step_schedules)
+
+# trial types and how many of each appear in a run
+conditions = {
+    'loss.high':   5,
+    'loss.low':    5,
+    'neutral':     10,
+    'reward.high': 5,
+    'reward.low':  5,
+}
+
+UP = 1
+DOWN = -1
+
+
+def target_hit_rate():
+    """The hit rate an nUp/nDown staircase converges to"""
+    return 0.5 ** (1.0 / n_down)
+
+
+def make_observers(n, rng, rt_mean=0.25, rt_mean_sd=0.03, rt_sd=0.04, rt_sd_sd=0.01):
+    """
+    Draw `n` synthetic observers, each with their own RT mean and spread in
+    seconds. Returns a dict of arrays.
+    """
+    mean = rng.normal(rt_mean, rt_mean_sd, n)
+    sd = np.clip(rng.normal(rt_sd, rt_sd_sd, n), 0.005, None)
+    return {'rt_mean': mean, 'rt_sd': sd}
+
+
+def true_threshold(observers, shift=0.0):
+    """
+    Staircase value (in frames) at which each observer hits at the rate the
+    staircase should converge to.
+    """
+    z = NormalDist().inv_cdf(target_hit_rate())
+    duration = observers['rt_mean'] + shift + z * observers['rt_sd']
+    return (duration - min_target_dur) / frame_duration
+
+
+def simulate_staircase(observers, n_trials, step_sizes, start_val=15.0, shift=0.0, rng=None):
+    """
+    Run one staircase per observer for `n_trials` trials.
+
+    `shift` is added to every observer's RT, to model conditions that are
+    faster or slower than others.
+
+    Returns (intensities, hits), both shaped (observers, trials).
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    m = len(observers['rt_mean'])
+    steps = np.asarray(step_sizes, dtype=float)
+
+    intensity = np.full(m, float(start_val))
+    step = np.full(m, steps[0])
+    counter = np.zeros(m, dtype=np.int64)
+    direction = np.zeros(m, dtype=np.int8)  # 0 is 'start'
+    n_reversals = np.zeros(m, dtype=np.int64)
+    previous = np.full(m, -1, dtype=np.int8)
+
+    intensities = np.empty((m, n_trials))
+    hits = np.empty((m, n_trials), dtype=bool)
+
+    for t in range(n_trials):
+        intensities[:, t] = intensity
+
+        duration = min_target_dur + frame_duration * intensity
+        rt = observers['rt_mean'] + shift + observers['rt_sd'] * rng.standard_normal(m)
+        hit = rt < duration
+        hits[:, t] = hit
+
+        # StairHandler.addResponse: count runs of the same response
+        same = previous == hit
+        counter = np.where(hit,
+                           np.where(same, counter + 1, 1),
+                           np.where(same, counter - 1, -1))
+        previous = hit.astype(np.int8)
+
+        # StairHandler.calculateNextIntensity: 1-up/1-down until the
+        # first reversal, then nUp/nDown
+        before_first = n_reversals == 0
+        go_down = np.where(before_first, hit, counter >= n_down)
+        go_up = np.where(before_first, ~hit, counter <= -n_up)
+
+        reversal = (go_down & (direction == UP)) | (go_up & (direction == DOWN))
+        direction = np.where(go_down, DOWN, np.where(go_up, UP, direction)).astype(np.int8)
+
+        n_reversals += reversal
+        next_step = steps[np.minimum(n_reversals, len(steps) - 1)]
+        step = np.where(reversal, next_step, step)
+
+        intensity = np.where(go_down, np.maximum(intensity - step, min_val),
+                             np.where(go_up, np.minimum(intensity + step, max_val), intensity))
+        counter = np.where(go_down | go_up, 0, counter)
+
+    return intensities, hits
+
+
+def convergence_trial(intensities, threshold, tolerance):
+    """
+    First trial (counting from 1) after which each staircase stays within
+    `tolerance` frames of the observer's threshold; NaN if it never settles.
+    """
+    inside = np.abs(intensities - threshold[:, None]) <= tolerance
+    # a staircase has settled from trial t on if every trial from t is inside
+    settled = np.flip(np.logical_and.accumulate(np.flip(inside, axis=1), axis=1), axis=1)
+    first = np.argmax(settled, axis=1).astype(float) + 1
+    first[~settled.any(axis=1)] = np.nan
+    return first
+
+
+def simulate_conditions(n_observers=10000, num_runs=4, start_val=15.0, tolerance=2.0,
+                        shifts=None, schedules=None, seed=None):
+    """
+    Simulate every condition under every step-size schedule.
+
+    Trial counts per condition follow mid.py: each condition gets its share
+    of `num_runs` runs of `num_trials` trials. `shifts` optionally maps a
+    condition to an RT offset in seconds.
+
+    Returns {schedule: {condition: results}}, where results holds
+    per-observer arrays for 'convergence_trial', 'final', 'threshold' and
+    'hit_rate'.
+    """
+    rng = np.random.default_rng(seed)
+    shifts = shifts or {}
+    schedules = schedules or step_schedules
+    observers = make_observers(n_observers, rng)
+
+    results = {}
+    for name, step_sizes in schedules.items():
+        results[name] = {}
+        for condition, per_run in conditions.items():
+            n_trials = per_run * num_runs
+            shift = shifts.get(condition, 0.0)
+            threshold = true_threshold(observers, shift)
+            intensities, hits = simulate_staircase(
+                observers, n_trials, step_sizes, start_val, shift, rng)
+            results[name][condition] = {
+                'n_trials': n_trials,
+                'convergence_trial': convergence_trial(intensities, threshold, tolerance),
+                'final': intensities[:, -1],
+                'threshold': threshold,
+                'hit_rate': hits.mean(axis=1),
+            }
+    return results
+
+
+def summarize(results):
+    """Flatten simulate_conditions results into one row of statistics per cell"""
+    rows = []
+    for name, by_condition in results.items():
+        for condition, r in by_condition.items():
+            converged = ~np.isnan(r['convergence_trial'])
+            error = r['final'] - r['threshold']
+            row = {
+                'schedule': name,
+                'condition': condition,
+                'trials': r['n_trials'],
+                'converged': converged.mean(),
+                'hit_rate_mean': r['hit_rate'].mean(),
+                'hit_rate_sd': r['hit_rate'].std(),
+                'final_error_mean': error.mean(),
+                'final_error_sd': error.std(),
+            }
+            if converged.any():
+                q = np.percentile(r['convergence_trial'][converged], [10, 50, 90])
+                row['convergence_p10'], row['convergence_p50'], row['convergence_p90'] = q
+            else:
+                row['convergence_p10'] = row['convergence_p50'] = row['convergence_p90'] = np.nan
+            rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('-n', '--observers', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=4, help='runs per session (1 for the behavioral practice)')
+    parser.add_argument('--start', type=float, default=15.0, help='staircase start value in frames')
+    parser.add_argument('--tolerance', type=float, default=2.0, help='frames from threshold that count as converged')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    results = simulate_conditions(args.observers, args.runs, args.start, args.tolerance, seed=args.seed)
+
+    print(f"target hit rate {target_hit_rate():.3f}, {args.observers} observers, tolerance {args.tolerance} frames")
+    header = f"{'schedule':<12}{'condition':<13}{'trials':>7}{'conv%':>7}{'p10':>6}{'p50':>6}{'p90':>6}{'hit':>7}{'hit sd':>8}{'err':>7}{'err sd':>8}"
+    print(header)
+    for row in summarize(results):
+        print(f"{row['schedule']:<12}{row['condition']:<13}{row['trials']:>7}"
+              f"{row['converged'] * 100:>7.1f}{row['convergence_p10']:>6.0f}{row['convergence_p50']:>6.0f}{row['convergence_p90']:>6.0f}"
+              f"{row['hit_rate_mean']:>7.3f}{row['hit_rate_sd']:>8.3f}"
+              f"{row['final_error_mean']:>7.2f}{row['final_error_sd']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+stairstate.py
+
+Saving and restoring the state of a PsychoPy StairHandler as plain
+JSON-able values.
+
+Everything that decides where a staircase goes next lives in a handful of
+attributes (its history of intensities and responses, reversals, step sizes
+and direction), so copying those out is enough to store a staircase, and
+copying them back into a new StairHandler carries on where it left off.
+"""
+
+state_fields = [
+    'thisTrialN',
+    'data',
+    'intensities',
+    'reversalPoints',
+    'reversalIntensities',
+    'currentDirection',
+    'correctCounter',
+    'stepSizes',
+    'stepSizeCurrent',
+    'initialRule',
+    'finished',
+    '_nextIntensity',
+]
+
+
+def plain(value):
+    # numpy scalars and lists of them, as plain Python values
+    if isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def get_state(stair):
+    """A staircase's state as a dict of JSON-able values"""
+    if hasattr(stair, 'get_state'):
+        # procedures of our own, like quest.QuestStaircase, know their state
+        return stair.get_state()
+    return {name: plain(getattr(stair, name)) for name in state_fields}
+
+
+def set_state(stair, state):
+    """Put a state from get_state back into a staircase"""
+    if hasattr(stair, 'set_state'):
+        return stair.set_state(state)
+    for name in state_fields:
+        value = state[name]
+        setattr(stair, name, list(value) if isinstance(value, list) else value)
+    stair._variableStep = len(stair.stepSizes) > 1
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+startup.py
+
+Getting mid.py from the setup dialog to its first screen quickly.
+
+Measuring the frame rate takes a few seconds of flipping, and the answer
+only changes with the display, so it's measured once per monitor profile
+and resolution and kept in a small JSON cache. Images are decoded on a
+background thread while the window opens, so building the stimuli that
+use them later doesn't wait on the disk, and they're scaled once to the
+size they're shown at rather than resampled from full size on every draw.
+
+The first time a stimulus is drawn, its textures go to the GPU and its
+shaders get compiled, which can hold up that flip. `warm_up` draws every
+stimulus once into the back buffer and clears it without flipping, so that
+happens on a screen nobody is timing instead of in the first trial.
+"""
+import json
+import os
+import threading
+import time
+
+from PIL import Image
+
+
+def frame_rate_key(monitor_name, size):
+    return f"{monitor_name} {int(size[0])}x{int(size[1])}"
+
+
+def frame_rate(win, monitor_name, cache_path, remeasure=False):
+    """
+    The window's frame rate, from the cache if this monitor profile and
+    resolution have been measured before. Returns (rate, cached); rate is
+    None if it couldn't be measured.
+    """
+    key = frame_rate_key(monitor_name, win.size)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+    if not remeasure and key in cache:
+        return cache[key]['rate'], True
+
+    rate = win.getActualFrameRate()
+    if rate is not None:
+        cache[key] = {'rate': rate, 'measured': time.strftime('%Y-%m-%d %H:%M:%S')}
+        # write then rename, so a crash never leaves half a file
+        tmp = cache_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp, cache_path)
+    return rate, False
+
+
+class ImageLoader:
+    """Decodes image files on a background thread"""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.images = {}
+        self.thread = threading.Thread(target=self._load, name='imageloader', daemon=True)
+        self.thread.start()
+
+    def _load(self):
+        for path in self.paths:
+            try:
+                with Image.open(path) as im:
+                    self.images[path] = im.convert('RGBA')
+            except OSError:
+                # leave it to the stimulus to load, and complain, itself
+                pass
+
+    def get(self, path, size=None):
+        """
+        The decoded image, or the path if it couldn't be decoded. Given a
+        (width, height) `size` in pixels, the image is scaled to it once and
+        that's kept for next time.
+        """
+        self.thread.join()
+        image = self.images.get(path, path)
+        if size is None or isinstance(image, str):
+            return image
+        size = (int(round(size[0])), int(round(size[1])))
+        if image.size != size:
+            image = image.resize(size, Image.LANCZOS)
+            self.images[path] = image
+        return image
+
+
+def warm_up(win, stims):
+    """Draw each stimulus once into the back buffer, then clear it unseen"""
+    for stim in stims:
+        stim.draw()
+    win.clearBuffer()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+stimcache.py
+
+Pre-rendered feedback text for mid.py.
+
+Calling setText on a TextStim makes PsychoPy lay out the string and rebuild
+its glyph textures, which is slow enough to make the first feedback frame
+late. The set of per-trial amounts is small and known up front, so a
+TextStim is built for each one at startup. Running totals move in whole
+dollars and are kept in a small LRU of TextStims instead.
+"""
+from collections import OrderedDict
+
+from psychopy import visual
+
+
+def trial_cash_string(r):
+    if r > 0:
+        return f"+${r}.00"
+    elif r < 0:
+        return f"-${r * -1}.00"
+    else:
+        return f"${r}.00"
+
+
+def total_cash_string(r):
+    if r < 0:
+        return f"-${r * -1}.00"
+    else:
+        return f"${r}.00"
+
+
+def possible_rewards(ranges):
+    """Every amount a trial can pay out, given (low, high) reward ranges"""
+    rewards = {0}
+    for lo, hi in ranges:
+        rewards.update(range(lo, hi + 1))
+    return sorted(rewards)
+
+
+class FeedbackTextCache:
+    """
+    TextStims for every trial amount, built once, plus a bounded LRU of
+    TextStims for running totals.
+
+    `trial_kwargs` and `total_kwargs` are passed to visual.TextStim for the
+    trial and total lines respectively.
+    """
+
+    def __init__(self, win, ranges, trial_kwargs, total_kwargs, max_totals=32):
+        self.win = win
+        self.total_kwargs = total_kwargs
+        self.max_totals = max_totals
+        self.trial = {}
+        for r in possible_rewards(ranges):
+            self.trial[r] = visual.TextStim(win=win, text=trial_cash_string(r), **trial_kwargs)
+        self.totals = OrderedDict()
+        self.total_text(0)
+
+    def stims(self):
+        """Every TextStim built so far"""
+        return list(self.trial.values()) + list(self.totals.values())
+
+    def trial_text(self, reward):
+        return self.trial[reward]
+
+    def total_text(self, total):
+        """TextStim showing `total`, rendering it only if it isn't cached"""
+        stim = self.totals.get(total)
+        if stim is not None:
+            self.totals.move_to_end(total)
+            return stim
+        stim = visual.TextStim(win=self.win, text='[' + total_cash_string(total) + ']', **self.total_kwargs)
+        self.totals[total] = stim
+        if len(self.totals) > self.max_totals:
+            self.totals.popitem(last=False)
+        return stim
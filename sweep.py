@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+sweep.py
+
+Parameter sweep over reward ranges, earnings goal, nudge run and success
+rate, using the vectorized simulator in simulator.py.
+
+Every combination of the given values is one scenario. Scenarios are spread
+over a process pool, and each one's summary statistics are saved in a cache
+directory under a hash of its parameters, so re-running a sweep only
+simulates grid points that haven't been seen before.
+
+Reward ranges are either a preset name from `simulator.reward_presets` or
+HIGH/LOW ranges like `3-7/1-3`, meaning reward.high 3-7 and reward.low 1-3,
+with the losses mirrored.
+
+    python sweep.py --rewards stable range_1 4-7/1-4 --goal 35 40 45 \\
+        --nudge-run 3 4 --rate 0.56 0.66 0.76 --out sweep.csv
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from simulator import reward_presets, simulate_sessions
+
+# bump this if the simulator or the summary changes, so old results are ignored
+cache_version = 1
+default_cache_dir = 'sweep_cache'
+
+quantiles = [5, 25, 50, 75, 95]
+
+
+def parse_range(s):
+    lo, hi = s.split('-')
+    return (int(lo), int(hi))
+
+
+def parse_rewards(spec):
+    """Turn a preset name or a HIGH/LOW spec like `3-7/1-3` into a reward table"""
+    if spec in reward_presets:
+        return reward_presets[spec]
+    try:
+        high, low = spec.split('/')
+        high = parse_range(high)
+        low = parse_range(low)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"{spec!r} is not a preset ({', '.join(reward_presets)}) or HIGH/LOW ranges like 3-7/1-3")
+    return {
+        'reward.high': high,
+        'reward.low': low,
+        'loss.high': (-high[1], -high[0]),
+        'loss.low': (-low[1], -low[0]),
+    }
+
+
+def scenario_key(scenario):
+    blob = json.dumps([cache_version, scenario], sort_keys=True)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+
+def summarize(totals):
+    """Summary statistics for an array of session totals, as plain JSON types"""
+    lo = int(totals.min())
+    hi = int(totals.max())
+    counts = np.bincount(totals - lo, minlength=hi - lo + 1)
+    return {
+        'mean': float(totals.mean()),
+        'sd': float(totals.std()),
+        'min': lo,
+        'max': hi,
+        'quantiles': dict(zip([str(q) for q in quantiles],
+                              np.percentile(totals, quantiles).tolist())),
+        # one bin per whole dollar, starting at `min`
+        'histogram': counts.tolist(),
+    }
+
+
+def run_scenario(scenario):
+    # seed from the parameters so a scenario always gives the same answer
+    seed = int(scenario_key(scenario)[:16], 16)
+    totals = simulate_sessions(
+        scenario['success_rate'], scenario['rewards'], scenario['total_earnings_goal'],
+        nudge_run=scenario['nudge_run'], n=scenario['n'], seed=seed)
+    return summarize(totals)
+
+
+def cache_path(cache_dir, scenario):
+    return os.path.join(cache_dir, scenario_key(scenario) + '.json')
+
+
+def load_cached(cache_dir, scenario):
+    path = cache_path(cache_dir, scenario)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)['summary']
+
+
+def save_cached(cache_dir, scenario, summary):
+    path = cache_path(cache_dir, scenario)
+    # write then rename, so an interrupted sweep never leaves half a file
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'scenario': scenario, 'summary': summary}, f)
+    os.replace(tmp, path)
+
+
+def make_grid(rewards, goals, nudge_runs, rates, n):
+    grid = []
+    for (name, table), goal, nudge_run, rate in itertools.product(rewards, goals, nudge_runs, rates):
+        grid.append({
+            'rewards_name': name,
+            'rewards': {k: list(v) for k, v in table.items()},
+            'total_earnings_goal': goal,
+            'nudge_run': nudge_run,
+            'success_rate': rate,
+            'n': n,
+        })
+    return grid
+
+
+def sweep(grid, cache_dir=default_cache_dir, workers=None):
+    """
+    Summarize every scenario in `grid`, simulating only the ones missing
+    from the cache. Returns a list of (scenario, summary) in grid order.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    results = [load_cached(cache_dir, s) for s in grid]
+    todo = [i for i, r in enumerate(results) if r is None]
+    print(f"{len(grid)} scenarios, {len(grid) - len(todo)} cached, {len(todo)} to simulate")
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_scenario, grid[i]): i for i in todo}
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                results[i] = future.result()
+                save_cached(cache_dir, grid[i], results[i])
+                print(f"\r{done}/{len(todo)} simulated", end='', flush=True)
+        print()
+
+    return list(zip(grid, results))
+
+
+def write_csv(results, out):
+    fields = ['rewards', 'total_earnings_goal', 'nudge_run', 'success_rate', 'n', 'mean', 'sd', 'min', 'max']
+    fields += [f'q{q}' for q in quantiles]
+    with open(out, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for scenario, summary in results:
+            writer.writerow([
+                scenario['rewards_name'], scenario['total_earnings_goal'], scenario['nudge_run'],
+                scenario['success_rate'], scenario['n'],
+                summary['mean'], summary['sd'], summary['min'], summary['max'],
+            ] + [summary['quantiles'][str(q)] for q in quantiles])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--rewards', nargs='+', default=['stable', 'range_1'],
+                        help='reward presets or HIGH/LOW ranges like 3-7/1-3')
+    parser.add_argument('--goal', nargs='+', type=int, default=[40], help='total_earnings_goal values')
+    parser.add_argument('--nudge-run', nargs='+', type=int, default=[4],
+                        help='first run to nudge, counting from 1 (4 never nudges)')
+    parser.add_argument('--rate', nargs='+', type=float, default=[0.56, 0.66, 0.76], help='success rates')
+    parser.add_argument('-n', '--sessions', type=int, default=100000, help='sessions per scenario')
+    parser.add_argument('--cache', default=default_cache_dir, help='result cache directory')
+    parser.add_argument('--workers', type=int, default=None, help='processes to use (default: all cores)')
+    parser.add_argument('--out', help='write a CSV of results here')
+    args = parser.parse_args()
+
+    rewards = []
+    for spec in args.rewards:
+        try:
+            rewards.append((spec, parse_rewards(spec)))
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+
+    grid = make_grid(rewards, args.goal, args.nudge_run, args.rate, args.sessions)
+    results = sweep(grid, args.cache, args.workers)
+
+    if args.out:
+        write_csv(results, args.out)
+    else:
+        print(f"{'rewards':<14}{'goal':>5}{'nudge':>6}{'rate':>6}{'mean':>8}{'sd':>7}{'q5':>6}{'q50':>6}{'q95':>6}")
+        for scenario, summary in results:
+            q = summary['quantiles']
+            print(f"{scenario['rewards_name']:<14}{scenario['total_earnings_goal']:>5}{scenario['nudge_run']:>6}"
+                  f"{scenario['success_rate']:>6.2f}{summary['mean']:>8.2f}{summary['sd']:>7.2f}"
+                  f"{q['5']:>6.0f}{q['50']:>6.0f}{q['95']:>6.0f}")
+
+
+if __name__ == '__main__':
+    main()
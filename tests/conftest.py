@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+conftest.py
+
+The modules under test are flat at the top of the repository.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
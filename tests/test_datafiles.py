@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+test_datafiles.py
+
+Session files that stopped before the first trial.
+"""
+import numpy as np
+
+from analysis import session_summary
+from datafiles import read_session, trial_rows
+from timing_qa import session_timing
+
+# what an ExperimentHandler CSV holds when the task is stopped during the
+# instructions: setup dialog values and nothing else
+no_trials = (
+    "participant,session,fMRI? (yes or no),expName,frameRate,\n"
+    "9201,1,yes,MID1.0,60.0,\n"
+)
+
+
+def write_session(tmp_path):
+    path = tmp_path / "MID1.0_fmri_9201.csv"
+    path.write_text(no_trials)
+    return str(path)
+
+
+def test_trial_rows_without_trials(tmp_path):
+    columns = read_session(write_session(tmp_path))
+    trials = trial_rows(columns)
+    assert trials.dtype == bool
+    assert len(trials) == 1 and not trials.any()
+
+
+def test_trial_rows_empty():
+    assert len(trial_rows({})) == 0
+
+
+def test_summaries_without_trials(tmp_path):
+    path = write_session(tmp_path)
+    summary = session_summary(path, str(tmp_path / "cache"))
+    assert summary['participant'] == '9201'
+    assert summary['hits'] == {} and np.isnan(summary['total_earnings'])
+
+    timing = session_timing(path, cache_dir=str(tmp_path / "cache"))
+    assert len(timing['run']) == 0 and timing['planned'].shape == (0, 3)
+
+
+# a session escaped after three misses: mid.py only writes trial.rt on a
+# hit, so there's no such column
+no_hits = (
+    "participant,session,run.order.file,trial.number,trial.type,run,trial.response,"
+    "trial.staircase.durationFrames,trial.staircase.thisTrialN,trial.reward,total_earnings,\n"
+    "9203,1,orders/357.csv,,,0,,,,,,\n"
+    "9203,1,,1,loss.low,0,0,15,0,-1,-1,\n"
+    "9203,1,,2,neutral,0,0,21,0,0,-1,\n"
+    "9203,1,,3,loss.high,0,0,15,0,-7,-8,\n"
+)
+
+
+def test_summaries_without_hits(tmp_path):
+    path = tmp_path / "MID1.0_fmri_9203.csv"
+    path.write_text(no_hits)
+    summary = session_summary(str(path), str(tmp_path / "cache"))
+    assert summary['hits'][('loss.low', 0)] == (1, 0)
+    assert all(len(rts) == 0 for rts in summary['rts'].values())
+    assert summary['total_earnings'] == -8
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+test_datawriter.py
+
+A resumed session's streamed rows go to a new file and leave the first
+session's rows alone.
+"""
+from datafiles import find_sessions, iter_rows
+from datawriter import RowStreamWriter
+
+
+def stream(path, info, trials):
+    writer = RowStreamWriter(path, extraInfo=info)
+    for n in trials:
+        writer.addData('trial.number', n)
+        writer.addData('trial.reward', n % 3)
+        writer.nextEntry()
+    writer.close()
+    return writer.path
+
+
+def test_resume_keeps_earlier_rows(tmp_path):
+    path = str(tmp_path / "MID1.0_fmri_9202.jsonl")
+    first = stream(path, {'participant': 9202, 'resume from checkpoint? (yes or no)': 'no'}, range(1, 47))
+    with open(first) as f:
+        before = f.read()
+
+    resumed = stream(path, {'participant': 9202, 'resume from checkpoint? (yes or no)': 'yes'}, range(47, 121))
+
+    assert first == path
+    assert resumed == str(tmp_path / "MID1.0_fmri_9202_1.jsonl")
+    with open(first) as f:
+        assert f.read() == before
+    assert find_sessions(str(tmp_path)) == [first, resumed]
+    numbers = [row['trial.number'] for p in (first, resumed) for row in iter_rows(p)]
+    assert numbers == list(range(1, 121))
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+test_scoring.py
+
+scoring.Staircase against the StairHandler mid.py runs, on the same
+responses.
+"""
+import random
+
+import pytest
+from psychopy import data
+
+import scoring
+
+
+def stair_handler(n_trials, start_val, start_run):
+    # as mid.py's make_stairs builds them
+    return data.StairHandler(startVal=start_val, stepType='lin',
+                             stepSizes=scoring.step_sizes(start_run),
+                             minVal=scoring.min_val, maxVal=scoring.max_val,
+                             nUp=scoring.n_up, nDown=scoring.n_down, nTrials=n_trials)
+
+
+@pytest.mark.parametrize('start_run', [0, 1])
+def test_staircase_matches_stairhandler(start_run):
+    rng = random.Random(start_run)
+    for _ in range(300):
+        n_trials = rng.choice([20, 40])
+        start_val = rng.randint(0, 30)
+        hit_rate = rng.random()
+        ours = scoring.make_staircase(n_trials, start_val, start_run)
+        theirs = stair_handler(n_trials, start_val, start_run)
+        # past nTrials too, until StairHandler has its reversals and stops
+        for _ in range(200):
+            try:
+                expected = next(theirs)
+            except StopIteration:
+                with pytest.raises(StopIteration):
+                    next(ours)
+                break
+            assert next(ours) == expected
+            response = int(rng.random() < hit_rate)
+            ours.addResponse(response)
+            theirs.addResponse(response)
+        assert ours.reversalIntensities == theirs.reversalIntensities
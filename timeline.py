@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+timeline.py
+
+A run of mid.py as a flat, precompiled list of routines, and the one loop
+that plays any of them.
+
+Everything about a run's timing that doesn't depend on the participant is
+known from its order file and speed factor before the run starts: which cue
+each trial shows, and how many frames each cue, fixation, target window and
+feedback screen lasts. `compile_run` turns that into a structured array
+with one record per routine: the routine, the stimulus it shows, its
+length in frames, and its planned onset and end on the run clock (from
+schedule.py). The few things that are decided as the run goes (how long the
+target stays up, which feedback is shown, the final fixation's RT
+adjustment) are filled in by mid.py when it gets to them.
+
+`RoutineEngine.play` shows a set of stimuli for a number of flips and
+collects key presses, with nothing allocated per frame beyond what the
+keyboard returns, so adding a routine is adding a record, not a loop.
+"""
+import numpy as np
+
+from fliprecorder import routines
+from schedule import planned_onsets
+
+# stimuli a record can name; cues are named by trial type after these
+stim_names = ['fixation', 'target', 'feedback']
+
+slot_dtype = np.dtype([
+    ('trial', np.int16),     # -1 for the initial fixation
+    ('routine', np.int8),    # index into fliprecorder.routines
+    ('stim', np.int8),       # index into the run's stimulus names
+    ('frames', np.int32),
+    ('onset', np.float64),   # planned, on the run clock
+    ('end', np.float64),
+])
+
+# the routines in every trial, in order
+trial_routines = ['cue', 'fixation', 'target', 'fixation', 'feedback', 'fixation']
+
+
+def frames_for(seconds, frame_duration):
+    return max(int(round(float(seconds) / frame_duration)), 0)
+
+
+def compile_run(order, first_trial, trial_types, frame_duration, initial_fix, cue_time,
+                max_target_dur, feedback_time, speed=1.0):
+    """
+    The timeline for a run starting at `first_trial` of `order`: an initial
+    fixation, then six routines per trial. Returns (timeline, names), where
+    `names` are the stimulus names the `stim` field indexes.
+    """
+    names = stim_names + list(trial_types)
+    trials = order[first_trial:]
+    plan = planned_onsets(trials, initial_fix, cue_time, max_target_dur, feedback_time, speed)
+    timeline = np.zeros(1 + len(trials) * len(trial_routines), dtype=slot_dtype)
+
+    fixation = names.index('fixation')
+    timeline[0] = (-1, routines.index('fixation'), fixation, frames_for(initial_fix, frame_duration),
+                   0.0, plan[0]['cue'] if plan else 0.0)
+    for k, (trial, p) in enumerate(zip(trials, plan)):
+        # what each of the six routines shows, for how long, from and to when
+        slots = [
+            (names.index(trial['trial.type']), cue_time, p['cue'], p['cue'] + cue_time),
+            (fixation, float(trial['fix.after.cue']) * speed, p['cue'] + cue_time, p['target']),
+            (names.index('target'), max_target_dur, p['target'], p['target'] + max_target_dur),
+            (fixation, float(trial['fix.after.stim']) * speed, p['target'] + max_target_dur, p['feedback']),
+            (names.index('feedback'), feedback_time, p['feedback'], p['feedback'] + feedback_time),
+            (fixation, float(trial['fix.after.feedback']) * speed, p['feedback'] + feedback_time, p['end']),
+        ]
+        base = 1 + k * len(trial_routines)
+        for j, (routine, (stim, seconds, onset, end)) in enumerate(zip(trial_routines, slots)):
+            timeline[base + j] = (first_trial + k, routines.index(routine), stim,
+                                  frames_for(seconds, frame_duration), onset, end)
+    return timeline, names
+
+
+def trial_slots(timeline, trial):
+    """The six records for `trial`, in order"""
+    first = int(np.searchsorted(timeline['trial'], trial))
+    return timeline[first:first + len(trial_routines)]
+
+
+class RoutineEngine:
+    """
+    Plays routines: draws a fixed set of stimuli for some number of flips
+    and watches the keys. `clock` is read after every flip into `times`,
+    which is allocated once, so `times[i]` is when flip i of the last
+    routine happened. Escape keys call `on_escape`.
+    """
+
+    def __init__(self, win, keys, clock, frame_duration, response_keys, escape_keys, on_escape,
+                 max_frames=2 ** 14):
+        self.win = win
+        self.keys = keys
+        self.clock = clock
+        self.frame_duration = frame_duration
+        self.response_keys = set(response_keys)
+        self.escape_keys = set(escape_keys)
+        self.on_escape = on_escape
+        self.times = np.zeros(max_frames)
+
+    def frames_until(self, onset, run_clock):
+        """Flips to show before the one that lands nearest `onset` on `run_clock`"""
+        return max(int(round((onset - run_clock.getTime()) / self.frame_duration)) - 1, 0)
+
+    def play(self, stims, frames, shown=None):
+        """
+        Flip `frames` times, drawing `stims` on the first `shown` flips (all
+        of them by default). Returns the time of the first response key
+        press from the first flip, or None.
+        """
+        win = self.win
+        keys = self.keys
+        clock = self.clock
+        times = self.times
+        if frames > len(times):
+            times = self.times = np.zeros(2 * frames)
+        if shown is None:
+            shown = frames
+        keys.clear()
+        win.callOnFlip(keys.reset_clock)  # rt counts from the first flip
+        rt = None
+        for flip in range(frames):
+            if flip < shown:
+                for stim in stims:
+                    stim.draw()
+            win.flip()
+            times[flip] = clock.getTime()
+            presses = keys.get_presses()
+            if presses:
+                for key, key_rt in presses:
+                    if key.lower() in self.escape_keys:
+                        self.on_escape()
+                    if rt is None and key in self.response_keys and key_rt >= 0:
+                        rt = key_rt
+        return rt
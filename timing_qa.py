@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+timing_qa.py
+
+Planned vs actual event timing for every run of every session in `data/`.
+
+Each session's trial rows are joined to the order recorded in their run's
+`run.order.file` (a CSV, or an order bank reference), matching on the
+trial's fixation durations, which are unique within an order. The planned
+cue, target and feedback onsets come from the order as schedule.py works
+them out for mid.py; the actual ones are the `time.*.onset` columns, or for
+older data the cue onset from `time.onset` and the run clock. Onset error
+is actual minus planned. Drift is how far the cue error has moved since the
+run's first trial, which doesn't depend on when the run clock started, and
+a run is flagged when its drift gets beyond a fraction of a TR.
+
+Sessions are read over a process pool with analysis.py's column cache; the
+errors and per-run summaries are then worked out for all sessions at once.
+
+    python timing_qa.py data --tr 2.0 --tolerance 0.25 --out qa
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from analysis import default_cache_dir, first_value, load_columns, write_rows
+from datafiles import column, find_sessions, trial_rows
+from orderbank import load_order
+from schedule import planned_onsets
+from scoring import cue_time, feedback_time, initial_fix_duration, max_target_dur, single_speed_factor
+
+events = ['cue', 'target', 'feedback']
+default_orders_dir = 'orders'
+
+
+@lru_cache(maxsize=None)
+def read_order(ref, orders_dir):
+    """An order by its recorded reference, looked for in `orders_dir` if it's from another machine"""
+    path, _, index = ref.partition('#')
+    if not os.path.exists(path):
+        path = os.path.join(orders_dir, os.path.basename(path.replace('\\', '/')))
+    return load_order(path + ('#' + index if index else ''))
+
+
+def order_plan(ref, orders_dir, run, sped):
+    """
+    Fixation durations (as the join key) and planned run-clock onsets, shape
+    (trials, 3), for an order. mid.py speeds up the initial fixation from
+    the practice run on, and the other fixations on the practice run.
+    """
+    order = read_order(ref, orders_dir)
+    initial = initial_fix_duration * (single_speed_factor if sped else 1.0)
+    speed = single_speed_factor if run == 0 else 1.0
+    plan = planned_onsets(order, initial, cue_time, max_target_dur, feedback_time, speed)
+    keys = np.array([float(t['fix.after.cue']) for t in order])
+    return keys, np.array([[p[e] for e in events] for p in plan])
+
+
+def session_timing(path, orders_dir=default_orders_dir, cache_dir=default_cache_dir):
+    """Planned and actual onsets for every trial in a session, as arrays"""
+    columns, _ = load_columns(path, cache_dir)
+    trials = trial_rows(columns)
+    rows = np.flatnonzero(trials)
+    runs = column(columns, 'run', trials).astype(int)
+
+    # run.order.file is on the row that starts each run
+    refs = columns.get('run.order.file', np.full(len(trials), ''))
+    starts = np.flatnonzero((refs != '') & ~trials)
+    run_ref = refs[starts][np.searchsorted(starts, rows, side='right') - 1]
+
+    actual = np.column_stack([column(columns, f'time.{e}.onset', trials) for e in events])
+    # older data only has the trial start on the global clock
+    legacy = np.isnan(actual[:, 0])
+    run_start = column(columns, 'time.global', trials) - column(columns, 'time.run', trials)
+    actual[legacy, 0] = column(columns, 'time.onset', trials)[legacy] - run_start[legacy]
+
+    fix_cue = column(columns, 'fix.after.cue', trials)
+    planned = np.full((len(rows), len(events)), np.nan)
+    index = np.full(len(rows), -1)
+    sped = len(runs) > 0 and runs.min() == 0
+    for run in np.unique(runs):
+        mask = runs == run
+        keys, plan = order_plan(str(run_ref[mask][0]), orders_dir, run, sped)
+        # join on fix.after.cue, which is unique within an order
+        order_index = np.argsort(keys)
+        found = np.clip(np.searchsorted(keys[order_index], fix_cue[mask]), 0, len(keys) - 1)
+        matched = keys[order_index][found] == fix_cue[mask]
+        i = np.where(matched, order_index[found], -1)
+        if matched.any():
+            # a resumed run's plan starts over at its first trial
+            first = i[matched].min()
+            shift = plan[first, 0] - plan[0, 0]
+            planned[mask] = np.where(matched[:, None], plan[i] - shift, np.nan)
+        index[mask] = i
+
+    return {
+        'path': path,
+        'participant': first_value(columns.get('participant', [])),
+        'session': first_value(columns.get('session', [])),
+        'run': runs,
+        'trial': index,
+        'planned': planned,
+        'actual': actual,
+    }
+
+
+def timing_sessions(paths, orders_dir=default_orders_dir, cache_dir=default_cache_dir, workers=None):
+    n = len(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(session_timing, paths, [orders_dir] * n, [cache_dir] * n))
+
+
+def run_summaries(sessions, tr=2.0, tolerance=0.25):
+    """
+    One row per run of every session: mean and largest onset errors by
+    event, final and largest drift, and whether the drift is beyond
+    `tolerance` of a TR of `tr` seconds.
+    """
+    counts = [len(s['run']) for s in sessions]
+    if not sum(counts):
+        return []
+    session = np.repeat(np.arange(len(sessions)), counts)
+    run = np.concatenate([s['run'] for s in sessions])
+    trial = np.concatenate([s['trial'] for s in sessions])
+    error = np.concatenate([s['actual'] - s['planned'] for s in sessions])
+
+    # sort into runs, trials in order, unmatched trials last
+    order = np.lexsort((np.where(trial < 0, np.iinfo(trial.dtype).max, trial), run, session))
+    session, run, trial, error = session[order], run[order], trial[order], error[order]
+    group = np.r_[True, (session[1:] != session[:-1]) | (run[1:] != run[:-1])]
+    starts = np.flatnonzero(group)
+    group_id = np.cumsum(group) - 1
+
+    drift = error[:, 0] - error[starts, 0][group_id]
+    abs_error = np.abs(error)
+    with np.errstate(invalid='ignore'):
+        matched = np.add.reduceat((trial >= 0).astype(int), starts)
+        max_drift = np.fmax.reduceat(np.abs(drift), starts)
+        max_error = np.fmax.reduceat(abs_error, starts)
+        sums = np.add.reduceat(np.nan_to_num(error), starts)
+        n = np.add.reduceat((~np.isnan(error)).astype(int), starts)
+        mean_error = sums / n
+    ends = np.r_[starts[1:], len(run)] - 1
+    last = starts + np.maximum(matched, 1) - 1
+    limit = tolerance * tr
+
+    rows = []
+    for g, start in enumerate(starts):
+        s = sessions[session[start]]
+        row = {'participant': s['participant'], 'session': s['session'], 'run': int(run[start]),
+               'trials': int(ends[g] - start + 1), 'matched': int(matched[g])}
+        for j, e in enumerate(events):
+            row[f'{e}_error_mean'] = mean_error[g, j]
+            row[f'{e}_error_max'] = max_error[g, j]
+        row['drift_final'] = drift[last[g]] if matched[g] else np.nan
+        row['drift_max'] = max_drift[g]
+        row['flagged'] = bool(max_drift[g] > limit) or matched[g] < row['trials']
+        row['file'] = s['path']
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('data_dir', nargs='?', default='data')
+    parser.add_argument('--orders', default=default_orders_dir,
+                        help="where to look for order files recorded with another machine's path")
+    parser.add_argument('--tr', type=float, default=2.0, help='repetition time in seconds')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='drift allowed, as a fraction of a TR')
+    parser.add_argument('--cache-dir', default=default_cache_dir)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default=None, help='directory to write runs.csv to')
+    args = parser.parse_args()
+
+    paths = find_sessions(args.data_dir)
+    if not paths:
+        parser.error(f"no session files in {args.data_dir}")
+    sessions = timing_sessions(paths, args.orders, args.cache_dir, args.workers)
+    rows = run_summaries(sessions, args.tr, args.tolerance)
+
+    flagged = [r for r in rows if r['flagged']]
+    print(f"{len(sessions)} sessions, {len(rows)} runs, {len(flagged)} flagged "
+          f"(drift over {args.tolerance * args.tr * 1000:.0f} ms or trials not in their order)")
+    for r in flagged:
+        print(f"  {r['participant']} session {r['session']} run {r['run']}: drift max "
+              f"{r['drift_max'] * 1000:.1f} ms, final {r['drift_final'] * 1000:.1f} ms, "
+              f"{r['matched']}/{r['trials']} trials matched  {r['file']}")
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        write_rows(os.path.join(args.out, 'runs.csv'), rows)
+        print(f"\nwrote runs.csv to {args.out}")
+
+
+if __name__ == '__main__':
+    main()